@@ -3,27 +3,35 @@ Vanguard MLM System - Backend Server
 Sistema de Marketing Multinível com 7 níveis de acesso
 """
 
+import io
 import os
-import uuid
+import csv
+import json
+import time
 import asyncio
 import logging
+from functools import lru_cache
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query, UploadFile, File, Form
 from fastapi.responses import Response as FastAPIResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, EmailStr, Field
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+from bson import ObjectId
+from bson.errors import InvalidId
 from passlib.context import CryptContext
-from jose import JWTError, jwt
+import jwt
 from dotenv import load_dotenv
+from dateutil.relativedelta import relativedelta
 import httpx
+import orjson
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-from pywebpush import webpush, WebPushException
 
 load_dotenv()
 
@@ -34,14 +42,149 @@ logger = logging.getLogger(__name__)
 # Database
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "mlm_vanguard")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "200"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "20"))
+# Fail fast instead of queueing forever when every pooled connection is busy
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
 JWT_SECRET = os.environ.get("JWT_SECRET", "mlm_vanguard_secret_key")
 
-# Password hashing
+# Password hashing - bcrypt releases the GIL, so one thread per core; kept apart from the
+# default executor so logins never queue behind blocking push sends
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="bcrypt")
 
 # Scheduler
 scheduler = AsyncIOScheduler()
 
+# Audit log queue - drained in batches by log_writer
+log_queue: asyncio.Queue = asyncio.Queue()
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.05
+
+def log_event(doc: dict):
+    """Queue an audit log entry instead of awaiting db.logs.insert_one"""
+    log_queue.put_nowait(doc)
+
+# Fire-and-forget work (push delivery) that callers never wait on; holding the
+# task references keeps them from being garbage collected mid-flight
+_background_tasks = set()
+
+def _background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background task failed: {task.exception()}")
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+async def log_writer(db):
+    """Background task: insert queued logs every ~50 ms or 500 docs.
+    A None entry in the queue flushes what is pending and stops the writer."""
+    running = True
+    while running:
+        batch = [await log_queue.get()]
+        try:
+            while len(batch) < LOG_BATCH_SIZE:
+                batch.append(log_queue.get_nowait())
+        except asyncio.QueueEmpty:
+            pass
+
+        if None in batch:
+            running = False
+            batch = [doc for doc in batch if doc is not None]
+
+        if batch:
+            try:
+                await db.logs.insert_many(batch, ordered=False)
+            except Exception as e:
+                logger.error(f"Error writing audit logs: {e}")
+
+        # A full batch means a backlog is building up - keep draining without pausing
+        if running and len(batch) < LOG_BATCH_SIZE:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+
+# Global settings cache - settings change rarely, so reads are served from memory
+SETTINGS_CACHE_TTL = 60
+_settings_cache = {"value": None, "ts": 0.0}
+
+async def get_cached_settings(db) -> Optional[dict]:
+    """Return the global settings document, reloading it at most every SETTINGS_CACHE_TTL seconds"""
+    if _settings_cache["value"] is not None and time.monotonic() - _settings_cache["ts"] < SETTINGS_CACHE_TTL:
+        return _settings_cache["value"]
+    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
+    _settings_cache["value"] = settings
+    _settings_cache["ts"] = time.monotonic()
+    return settings
+
+def prime_settings_cache(settings: Optional[dict]):
+    """Store a freshly read settings document so the next read is served from memory"""
+    _settings_cache["value"] = settings
+    _settings_cache["ts"] = time.monotonic()
+
+async def settings_watcher(db):
+    """Prime the settings cache from a change stream, so updates made by other workers apply immediately"""
+    try:
+        async with await db.settings.watch(
+            [{"$match": {"fullDocument.settings_id": "global"}}],
+            full_document="updateLookup"
+        ) as stream:
+            async for change in stream:
+                settings = change.get("fullDocument")
+                if settings is not None:
+                    settings.pop("_id", None)
+                prime_settings_cache(settings)
+    except PyMongoError as e:
+        # Standalone servers have no change streams; the TTL alone bounds staleness there
+        logger.info(f"Settings change stream unavailable, using TTL cache only: {e}")
+
+# Admin dashboard cache - polled by every open admin panel, recomputed at most every 30s
+ADMIN_DASHBOARD_CACHE_TTL = 30
+_admin_dashboard_cache = {"value": None, "ts": 0.0}
+_admin_dashboard_lock = asyncio.Lock()
+
+def invalidate_admin_dashboard_cache():
+    _admin_dashboard_cache["ts"] = 0.0
+
+# Per-user dashboard cache - keyed by (dashboard, user_id, month, version); order, commission
+# and withdrawal writes bump the version so results computed before a write are never stored
+DASHBOARD_CACHE_TTL = 30
+DASHBOARD_CACHE_MAX_SIZE = 4096
+_dashboard_cache: dict = {}
+_dashboard_inflight: dict = {}
+_dashboard_cache_version = 0
+
+def invalidate_dashboard_cache():
+    global _dashboard_cache_version
+    _dashboard_cache_version += 1
+    _dashboard_cache.clear()
+
+async def cached_dashboard(name: str, user_id: str, compute) -> dict:
+    """Serve a per-user dashboard from cache; concurrent misses share one computation"""
+    key = (name, user_id, datetime.now(timezone.utc).strftime("%Y%m"), _dashboard_cache_version)
+    
+    cached = _dashboard_cache.get(key)
+    if cached and time.monotonic() - cached[0] < DASHBOARD_CACHE_TTL:
+        return cached[1]
+    
+    task = _dashboard_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        _dashboard_inflight[key] = task
+        task.add_done_callback(lambda _: _dashboard_inflight.pop(key, None))
+    
+    # Shielded so a disconnecting client does not cancel the computation for other waiters
+    value = await asyncio.shield(task)
+    
+    if key[3] == _dashboard_cache_version:
+        _dashboard_cache.pop(key, None)
+        if len(_dashboard_cache) >= DASHBOARD_CACHE_MAX_SIZE:
+            _dashboard_cache.pop(next(iter(_dashboard_cache)))
+        _dashboard_cache[key] = (time.monotonic(), value)
+    return value
+
 # Access Levels
 ACCESS_LEVELS = {
     0: "admin_tecnico",
@@ -55,40 +198,139 @@ ACCESS_LEVELS = {
 
 # ==================== SCHEDULED JOBS ====================
 
+JOB_BATCH_SIZE = 1000
+# How many recent credit keys (release batch ids and paid order ids) each user keeps, to make
+# balance and counter increments idempotent. Uplines get a key for every order in their downline,
+# so this covers the window in which reconcile_paid_orders retries an interrupted order.
+CREDIT_BATCH_HISTORY = 200
+# Paid orders still unprocessed after this long are assumed interrupted and finished by the reconcile job
+PAID_ORDER_RECONCILE_DELAY = timedelta(minutes=5)
+
+async def release_commission_batch(db, commission_ids: List[str], now: datetime) -> int:
+    """Flip blocked commissions to available and credit their owners' balances.
+    The flip is a check-and-set on "blocked" that tags the commissions with a batch id
+    and credited=False, so a crash before the credit is finished is picked up by
+    reconcile_released_commissions instead of being lost."""
+    batch_id = generate_id("rel_")
+    await db.commissions.bulk_write([
+        UpdateOne(
+            {"commission_id": commission_id, "status": "blocked"},
+            {"$set": {"status": "available", "released_at": now, "credit_batch": batch_id, "credited": False}}
+        )
+        for commission_id in commission_ids
+    ], ordered=False)
+    return await credit_commission_batch(db, batch_id)
+
+async def credit_commission_batch(db, batch_id: str) -> int:
+    """Credit the balances for a release batch exactly once. Each user's $inc is guarded
+    by the batch id, so re-running a batch skips users it already credited."""
+    commissions = await db.commissions.find(
+        {"credit_batch": batch_id, "credited": False},
+        {"_id": 0, "commission_id": 1, "user_id": 1, "amount": 1, "level": 1, "released_at": 1}
+    ).to_list(None)
+    if not commissions:
+        return 0
+    
+    user_totals = {}
+    for comm in commissions:
+        user_totals[comm["user_id"]] = user_totals.get(comm["user_id"], 0) + comm["amount"]
+    
+    await asyncio.gather(
+        db.users.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "credit_batches": {"$ne": batch_id}},
+                {
+                    "$inc": {"blocked_balance": -amount, "available_balance": amount},
+                    "$push": {"credit_batches": {"$each": [batch_id], "$slice": -CREDIT_BATCH_HISTORY}}
+                }
+            )
+            for user_id, amount in user_totals.items()
+        ], ordered=False),
+        # Upserted by commission, so a re-run never records a release twice
+        db.transactions.bulk_write([
+            UpdateOne(
+                {"type": "commission_released", "reference_id": comm["commission_id"]},
+                {"$setOnInsert": {
+                    "transaction_id": generate_id("tx_"),
+                    "user_id": comm["user_id"],
+                    "amount": comm["amount"],
+                    "description": f"Comissão liberada - Nível {comm.get('level', 0)}",
+                    "created_at": comm["released_at"]
+                }},
+                upsert=True
+            )
+            for comm in commissions
+        ], ordered=False)
+    )
+    await db.commissions.update_many(
+        {"credit_batch": batch_id, "credited": False},
+        {"$set": {"credited": True}}
+    )
+    return len(commissions)
+
+async def reconcile_released_commissions(db) -> int:
+    """Finish crediting release batches that were interrupted after the status flip"""
+    credited = 0
+    for batch_id in await db.commissions.distinct("credit_batch", {"credited": False}):
+        credited += await credit_commission_batch(db, batch_id)
+    if credited:
+        logger.warning(f"Reconciled {credited} released but uncredited commissions")
+    return credited
+
+async def reconcile_paid_orders(db) -> int:
+    """Finish the commissions, balances and volumes of paid orders whose processing was interrupted"""
+    settings = await get_cached_settings(db)
+    cutoff = datetime.now(timezone.utc) - PAID_ORDER_RECONCILE_DELAY
+    reconciled = 0
+    async for order in db.orders.find({"commissions_processed": False, "paid_at": {"$lte": cutoff}}, {"_id": 0}):
+        await apply_paid_order(db, order, settings)
+        reconciled += 1
+    if reconciled:
+        logger.warning(f"Reconciled {reconciled} paid orders with unprocessed commissions")
+    return reconciled
+
+async def reconcile_paid_orders_job(db):
+    """Periodically finish paid orders left half-processed by a failed status update"""
+    try:
+        await reconcile_paid_orders(db)
+    except Exception as e:
+        logger.error(f"Error in reconcile_paid_orders_job: {e}")
+
 async def release_commissions_job(db):
     """Release blocked commissions that are past the 7-day hold period"""
     try:
-        now = datetime.now(timezone.utc).isoformat()
+        now = datetime.now(timezone.utc)
         
-        # Find blocked commissions ready for release
-        blocked_commissions = await db.commissions.find({
+        # Finish any release a previous run left half-done before starting a new one
+        await reconcile_released_commissions(db)
+        
+        # Stream blocked commissions ready for release and apply them in chunks.
+        # The status flip is a check-and-set on "blocked" and each batch's credit is
+        # idempotent, so a re-run or an overlapping manual release never credits the same
+        # commission twice, and a crash mid-batch is finished by the next run.
+        # Like the manual /api/admin/process-commissions release, every commission released
+        # here also gets a commission_released transaction in the user's statement.
+        cursor = db.commissions.find({
             "status": "blocked",
             "release_at": {"$lte": now}
-        }, {"_id": 0}).to_list(10000)
+        }, {"_id": 0, "commission_id": 1}).batch_size(JOB_BATCH_SIZE)
         
+        commission_ids = []
         released_count = 0
-        for comm in blocked_commissions:
-            # Update commission status
-            await db.commissions.update_one(
-                {"commission_id": comm["commission_id"]},
-                {"$set": {"status": "available", "released_at": now}}
-            )
-            
-            # Move from blocked to available balance
-            await db.users.update_one(
-                {"user_id": comm["user_id"]},
-                {
-                    "$inc": {
-                        "blocked_balance": -comm["amount"],
-                        "available_balance": comm["amount"]
-                    }
-                }
-            )
-            released_count += 1
+        
+        async for comm in cursor:
+            commission_ids.append(comm["commission_id"])
+            if len(commission_ids) >= JOB_BATCH_SIZE:
+                released_count += await release_commission_batch(db, commission_ids, now)
+                commission_ids = []
+        
+        if commission_ids:
+            released_count += await release_commission_batch(db, commission_ids, now)
         
         if released_count > 0:
-            await db.logs.insert_one({
-                "log_id": f"log_{uuid.uuid4().hex[:12]}",
+            invalidate_dashboard_cache()
+            log_event({
+                "log_id": generate_id("log_"),
                 "action": "scheduled_commissions_released",
                 "user_id": "system",
                 "details": {"count": released_count},
@@ -102,7 +344,7 @@ async def release_commissions_job(db):
 async def check_qualifications_job(db):
     """Monthly check for reseller qualifications"""
     try:
-        settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
+        settings = await get_cached_settings(db)
         
         min_qualification = settings.get("min_qualification_amount", 100) if settings else 100
         suspend_months = settings.get("inactive_months_suspend", 6) if settings else 6
@@ -110,69 +352,56 @@ async def check_qualifications_job(db):
         
         now = datetime.now(timezone.utc)
         
-        # Get all resellers
-        resellers = await db.users.find({"access_level": 4}, {"_id": 0}).to_list(10000)
+        # "Inactive for N months" is counted in calendar months: last_qualification <= now - N months
+        cancel_cutoff = now - relativedelta(months=cancel_months)
+        suspend_cutoff = now - relativedelta(months=suspend_months)
+        not_qualified = {"personal_volume": {"$not": {"$gte": min_qualification}}}
         
-        suspended_count = 0
-        cancelled_count = 0
-        qualified_count = 0
+        # Classify resellers server-side; only ids come back
+        buckets = (await aggregate_list(db.users, [
+            {"$match": {"access_level": 4}},
+            {"$project": {"_id": 0, "user_id": 1, "sponsor_id": 1, "status": 1, "last_qualification": 1, "personal_volume": 1}},
+            {"$facet": {
+                "qualified": [
+                    {"$match": {"personal_volume": {"$gte": min_qualification}}},
+                    {"$project": {"user_id": 1}}
+                ],
+                "cancel": [
+                    {"$match": {**not_qualified, "status": {"$ne": "cancelled"}, "last_qualification": {"$lte": cancel_cutoff}}},
+                    {"$project": {"user_id": 1}}
+                ],
+                "suspend": [
+                    {"$match": {**not_qualified, "status": "active", "last_qualification": {"$lte": suspend_cutoff, "$gt": cancel_cutoff}}},
+                    {"$project": {"user_id": 1}}
+                ]
+            }}
+        ], 1))[0]
         
-        for reseller in resellers:
-            # Check if qualified this month
-            personal_volume = reseller.get("personal_volume", 0)
-            
-            if personal_volume >= min_qualification:
-                # Update qualification date
-                await db.users.update_one(
-                    {"user_id": reseller["user_id"]},
-                    {"$set": {"last_qualification": now.isoformat()}}
-                )
-                qualified_count += 1
-                continue
-            
-            # Check inactivity
-            last_qual = reseller.get("last_qualification")
-            if not last_qual:
-                continue
-            
-            last_qual_date = datetime.fromisoformat(last_qual)
-            if last_qual_date.tzinfo is None:
-                last_qual_date = last_qual_date.replace(tzinfo=timezone.utc)
-            
-            months_inactive = (now - last_qual_date).days // 30
-            
-            if months_inactive >= cancel_months and reseller.get("status") != "cancelled":
-                # Cancel and restructure network
-                await db.users.update_one(
-                    {"user_id": reseller["user_id"]},
-                    {"$set": {"status": "cancelled"}}
-                )
-                
-                # Move downline up to sponsor
-                await db.users.update_many(
-                    {"sponsor_id": reseller["user_id"]},
-                    {
-                        "$set": {"sponsor_id": reseller.get("sponsor_id")},
-                        "$inc": {"hierarchy_level": -1}
-                    }
-                )
-                cancelled_count += 1
-            
-            elif months_inactive >= suspend_months and reseller.get("status") == "active":
-                await db.users.update_one(
-                    {"user_id": reseller["user_id"]},
-                    {"$set": {"status": "suspended"}}
-                )
-                suspended_count += 1
+        qualified_ids = [r["user_id"] for r in buckets["qualified"]]
+        suspend_ids = [r["user_id"] for r in buckets["suspend"]]
+        cancel_ids = [r["user_id"] for r in buckets["cancel"]]
         
-        # Reset monthly volumes for all resellers and leaders
-        await db.users.update_many(
+        # The buckets are disjoint and every write touches different fields, so the
+        # qualification, suspension and cancellation updates and the monthly volume reset
+        # (resellers and leaders) run concurrently across the connection pool
+        writes = [db.users.update_many(
             {"access_level": {"$in": [3, 4]}},
             {"$set": {"personal_volume": 0, "team_volume": 0}}
-        )
+        )]
+        if qualified_ids:
+            writes.append(db.users.update_many({"user_id": {"$in": qualified_ids}}, {"$set": {"last_qualification": now}}))
+        if suspend_ids:
+            writes.append(db.users.update_many({"user_id": {"$in": suspend_ids}}, {"$set": {"status": "suspended"}}))
+        if cancel_ids:
+            writes.append(cancel_resellers(db, cancel_ids))
+        await asyncio.gather(*writes)
+        
+        qualified_count = len(qualified_ids)
+        suspended_count = len(suspend_ids)
+        cancelled_count = len(cancel_ids)
         
-        await db.logs.insert_one({
-            "log_id": f"log_{uuid.uuid4().hex[:12]}",
+        log_event({
+            "log_id": generate_id("log_"),
             "action": "scheduled_qualifications_checked",
             "user_id": "system",
             "details": {
@@ -180,31 +409,169 @@ async def check_qualifications_job(db):
                 "suspended": suspended_count,
                 "cancelled": cancelled_count
             },
-            "created_at": now.isoformat()
+            "created_at": now
         })
         
         logger.info(f"Scheduled job: Qualifications checked - Qualified: {qualified_count}, Suspended: {suspended_count}, Cancelled: {cancelled_count}")
     except Exception as e:
         logger.error(f"Error in check_qualifications_job: {e}")
 
+async def dedupe_achievements(db):
+    """Keep the earliest achievement per (user_id, goal_id) so the unique index can be built"""
+    indexes = await db.achievements.index_information()
+    if indexes.get("user_id_1_goal_id_1", {}).get("unique"):
+        return
+    duplicate_ids = []
+    async for group in await db.achievements.aggregate([
+        {"$sort": {"achieved_at": 1, "_id": 1}},
+        {"$group": {"_id": {"user_id": "$user_id", "goal_id": "$goal_id"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ], allowDiskUse=True):
+        duplicate_ids.extend(group["ids"][1:])
+    if duplicate_ids:
+        await db.achievements.delete_many({"_id": {"$in": duplicate_ids}})
+        logger.warning(f"Removed {len(duplicate_ids)} duplicate achievements")
+    # A non-unique index of the same name would block the unique one
+    if "user_id_1_goal_id_1" in indexes:
+        await db.achievements.drop_index("user_id_1_goal_id_1")
+
+async def ensure_indexes(db):
+    """Create the indexes backing the hot queries, sorts and aggregations"""
+    await db.users.create_indexes([
+        IndexModel("email", unique=True),
+        IndexModel("user_id", unique=True),
+        IndexModel("referral_code", unique=True),
+        IndexModel([("access_level", 1), ("status", 1)]),
+        IndexModel([("access_level", 1), ("status", 1), ("direct_referrals_count", -1)]),
+        IndexModel([("access_level", 1), ("status", 1), ("last_qualification", 1)]),
+        IndexModel([("sponsor_id", 1), ("access_level", 1)]),
+        IndexModel([("supervisor_id", 1), ("name", 1), ("_id", 1)]),
+        IndexModel("ancestors"),
+    ])
+    await db.products.create_indexes([
+        IndexModel("product_id", unique=True),
+        IndexModel([("category", 1), ("active", 1)]),
+        IndexModel(
+            [("name", "text"), ("description", "text")],
+            weights={"name": 3, "description": 1},
+            default_language="portuguese"
+        ),
+    ])
+    await db.orders.create_indexes([
+        IndexModel("order_id", unique=True),
+        IndexModel([("user_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("payment_status", 1), ("created_at", -1)]),
+        IndexModel([("order_status", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_at", -1), ("_id", -1)]),
+        # Trailing order_id/total make the recent referral orders list a covered query
+        IndexModel([("referrer_id", 1), ("payment_status", 1), ("created_at", -1), ("order_id", 1), ("total", 1)]),
+        IndexModel("paid_at", partialFilterExpression={"commissions_processed": False}),
+    ])
+    await db.commissions.create_indexes([
+        IndexModel("commission_id", unique=True),
+        IndexModel("order_id"),
+        IndexModel([("status", 1), ("release_at", 1)]),
+        IndexModel("credit_batch", partialFilterExpression={"credited": False}),
+        IndexModel([("user_id", 1), ("created_at", -1), ("status", 1)]),
+        IndexModel([("user_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("user_id", 1), ("status", 1), ("created_at", -1), ("_id", -1)]),
+    ])
+    await db.withdrawals.create_indexes([
+        IndexModel("withdrawal_id", unique=True),
+        IndexModel([("status", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("user_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_at", -1), ("_id", -1)]),
+    ])
+    await db.logs.create_indexes([
+        IndexModel([("action", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("user_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("action", 1), ("user_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_at", -1), ("_id", -1)]),
+    ])
+    await db.transactions.create_indexes([
+        IndexModel([("user_id", 1), ("created_at", -1)]),
+        IndexModel([("reference_id", 1), ("type", 1)]),
+    ])
+    await db.referral_clicks.create_indexes([
+        IndexModel([("referrer_id", 1), ("created_at", -1)]),
+        IndexModel([("referral_code", 1), ("created_at", -1)]),
+    ])
+    await dedupe_achievements(db)
+    await db.achievements.create_indexes([
+        IndexModel([("user_id", 1), ("goal_id", 1)], unique=True),
+        IndexModel([("user_id", 1), ("achieved_at", -1)]),
+    ])
+    await db.goals.create_indexes([
+        IndexModel("goal_id", unique=True),
+        IndexModel([("active", 1), ("end_date", 1)]),
+    ])
+    await db.invites.create_indexes([
+        IndexModel([("email", 1), ("status", 1)]),
+        IndexModel([("invited_by", 1), ("created_at", -1)]),
+        # Mongo drops pending invites once expires_at passes; accepted ones are kept
+        IndexModel(
+            [("expires_at", 1)],
+            expireAfterSeconds=0,
+            partialFilterExpression={"status": "pending"}
+        ),
+    ])
+    await db.notifications.create_indexes([
+        IndexModel([("user_id", 1), ("created_at", -1)]),
+        IndexModel([("user_id", 1), ("read", 1), ("created_at", -1)]),
+    ])
+    await db.tickets.create_indexes([
+        IndexModel("ticket_id", unique=True),
+        IndexModel([("user_id", 1), ("created_at", -1)]),
+        IndexModel([("status", 1), ("created_at", -1)]),
+    ])
+    await db.ticket_replies.create_indexes([
+        IndexModel([("ticket_id", 1), ("created_at", 1)]),
+    ])
+    await db.conversations.create_indexes([
+        IndexModel("conversation_id", unique=True),
+        IndexModel([("participants", 1), ("last_message_at", -1)]),
+    ])
+    await db.messages.create_indexes([
+        IndexModel([("conversation_id", 1), ("created_at", -1)]),
+        IndexModel([("conversation_id", 1), ("read", 1), ("sender_id", 1)]),
+    ])
+    await db.push_subscriptions.create_indexes([
+        IndexModel([("user_id", 1), ("endpoint", 1)], unique=True),
+        IndexModel("endpoint"),
+    ])
+
 # Lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.mongodb_client = AsyncIOMotorClient(MONGO_URL)
+    app.mongodb_client = AsyncMongoClient(
+        MONGO_URL,
+        tz_aware=True,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=60000,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=5000,
+        retryWrites=True
+    )
     app.db = app.mongodb_client[DB_NAME]
-    logger.info("Connected to MongoDB")
+    logger.info(f"Connected to MongoDB (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+
+    # Shared HTTP client so outbound calls reuse pooled keep-alive connections
+    app.http = httpx.AsyncClient(
+        timeout=10.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
     
     # Create indexes
-    await app.db.users.create_index("email", unique=True)
-    await app.db.users.create_index("user_id", unique=True)
-    await app.db.users.create_index("referral_code", unique=True)
-    await app.db.products.create_index("product_id", unique=True)
-    await app.db.orders.create_index("order_id", unique=True)
+    await ensure_indexes(app.db)
     
     # Initialize default admin and settings
     await initialize_defaults(app.db)
+    await run_data_migrations(app.db)
     
     # Setup scheduled jobs
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
     # Daily job: Release blocked commissions that are past 7 days
     scheduler.add_job(
         release_commissions_job,
@@ -214,6 +581,15 @@ async def lifespan(app: FastAPI):
         replace_existing=True
     )
     
+    # Every 10 minutes: finish paid orders whose commissions were interrupted
+    scheduler.add_job(
+        reconcile_paid_orders_job,
+        IntervalTrigger(minutes=10),
+        args=[app.db],
+        id="reconcile_paid_orders",
+        replace_existing=True
+    )
+    
     # Monthly job: Check qualifications on the 1st day of each month
     scheduler.add_job(
         check_qualifications_job,
@@ -224,13 +600,23 @@ async def lifespan(app: FastAPI):
     )
     
     scheduler.start()
-    logger.info("Scheduler started with jobs: release_commissions, check_qualifications")
-    
+    logger.info("Scheduler started with jobs: release_commissions, reconcile_paid_orders, check_qualifications")
+
+    # Background audit log writer
+    log_task = asyncio.create_task(log_writer(app.db))
+    settings_task = asyncio.create_task(settings_watcher(app.db))
+
     yield
-    
+
     scheduler.shutdown()
     logger.info("Scheduler stopped")
-    app.mongodb_client.close()
+    settings_task.cancel()
+    log_queue.put_nowait(None)
+    await log_task
+    logger.info("Audit log queue flushed")
+    await app.http.aclose()
+    password_executor.shutdown(wait=False)
+    await app.mongodb_client.close()
     logger.info("Disconnected from MongoDB")
 
 app = FastAPI(title="Vanguard MLM API", lifespan=lifespan)
@@ -307,17 +693,207 @@ class AmbassadorCommission(BaseModel):
 
 # ==================== HELPERS ====================
 
+def parse_datetime(value) -> Optional[datetime]:
+    """Parse an ISO-8601 string into an aware UTC datetime (datetimes pass through)"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def parse_date_param(value: Optional[str]) -> Optional[datetime]:
+    """parse_datetime for user-supplied dates, rejecting bad input with a 400"""
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+@lru_cache(maxsize=2)
+def _month_start(hour_bucket: int) -> datetime:
+    return datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def current_month_start() -> datetime:
+    """Start of the current UTC month, memoized per hour (months always start on an hour boundary)"""
+    return _month_start(int(time.time() // 3600))
+
+def month_key(value: datetime) -> str:
+    """Bucket key (YYYYMM) for the per-month counters on user documents"""
+    return value.strftime("%Y%m")
+
+def full_month_keys(start_date: datetime, end_date: datetime) -> Optional[List[str]]:
+    """Month keys exactly covered by [start_date, end_date], or None if the range
+    does not start on a month boundary and end on the last millisecond of a month"""
+    if not isinstance(start_date, datetime) or not isinstance(end_date, datetime):
+        return None
+    if start_date != start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0):
+        return None
+    
+    keys = []
+    month = start_date
+    while month <= end_date:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        keys.append(month_key(month))
+        if end_date < next_month:
+            # BSON dates have millisecond precision
+            return keys if next_month - end_date <= timedelta(milliseconds=1) else None
+        month = next_month
+    return None
+
+def csv_row_formatter(headers):
+    """Build a document -> CSV row function for a fixed header list.
+    csv.writer already writes None as an empty cell, so only date columns need converting."""
+    headers = tuple(headers)
+    date_columns = tuple(i for i, h in enumerate(headers) if h.endswith("_at"))
+    
+    def format_row(doc: dict) -> list:
+        row = [doc.get(h) for h in headers]
+        for i in date_columns:
+            if isinstance(row[i], datetime):
+                row[i] = row[i].isoformat()
+        return row
+    
+    return format_row
+
+EXPORT_CHUNK_SIZE = 500
+
+async def stream_csv_export(headers, docs, labels=None):
+    """Stream an async iterable of documents as CSV, flushing every EXPORT_CHUNK_SIZE rows.
+    `labels` replaces the header row when column titles differ from the document keys."""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(labels or headers)
+    format_row = csv_row_formatter(headers)
+    
+    chunk = []
+    async for doc in docs:
+        chunk.append(doc)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            writer.writerows(map(format_row, chunk))
+            chunk = []
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    writer.writerows(map(format_row, chunk))
+    yield output.getvalue()
+
+async def stream_json_export(key: str, docs):
+    """Stream an async iterable of documents as {key: [...], "total_count": n}"""
+    yield b'{"' + key.encode() + b'":['
+    
+    count = 0
+    chunk = []
+    async for doc in docs:
+        chunk.append(orjson.dumps(doc))
+        count += 1
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+            chunk = []
+    if chunk:
+        yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+    yield b'],"total_count":' + str(count).encode() + b"}"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def encode_page_cursor(doc: dict, field: str = "created_at") -> str:
+    """Opaque keyset cursor "<typed sort value>_<_id>" pointing just past doc.
+    The sort value keeps its type: d<epoch ms> for dates, s<text> for strings, n for null/missing"""
+    value = doc.get(field)
+    if isinstance(value, datetime):
+        encoded = f"d{(value - EPOCH) // timedelta(milliseconds=1)}"
+    elif value is None:
+        encoded = "n"
+    else:
+        encoded = f"s{value}"
+    return f"{encoded}_{doc['_id']}"
+
+def page_cursor_filter(cursor: str, field: str = "created_at", direction: int = -1) -> dict:
+    """Seek filter for the documents after the cursor on (field, _id) sorted in `direction`.
+    Null and missing values sort before everything else, so they come last when descending"""
+    try:
+        encoded, _, object_id = cursor.rpartition("_")
+        kind, raw = encoded[:1], encoded[1:]
+        if kind == "d":
+            value = EPOCH + timedelta(milliseconds=int(raw))
+        elif kind == "s":
+            value = raw
+        elif kind == "n" and not raw:
+            value = None
+        else:
+            raise ValueError(cursor)
+        object_id = ObjectId(object_id)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    past = "$gt" if direction > 0 else "$lt"
+    same_value = {field: value, "_id": {past: object_id}}
+    if value is None:
+        # Ascending, every non-null value follows; descending, nothing sorts below null
+        return {"$or": [{field: {"$ne": None}}, same_value]} if direction > 0 else same_value
+    
+    after = [{field: {past: value}}, same_value]
+    if direction < 0:
+        after.append({field: None})
+    return {"$or": after}
+
+async def fetch_page(
+    collection,
+    query: dict,
+    page: int,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+    sort_field: str = "created_at",
+    direction: int = -1
+):
+    """Page of a collection sorted on (sort_field, _id), newest first by default. With a cursor
+    the page is found by keyset instead of skip, so deep pages cost the same as the first.
+    One extra document is read to tell whether another page exists; next_cursor is
+    None on the last page"""
+    if cursor:
+        query = {"$and": [query, page_cursor_filter(cursor, sort_field, direction)]}
+    find = collection.find(query, projection).sort([(sort_field, direction), ("_id", direction)])
+    if not cursor:
+        find = find.skip((page - 1) * limit)
+    docs = await find.limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_page_cursor(docs[-1], sort_field)
+    for doc in docs:
+        del doc["_id"]
+    return docs, next_cursor
+
+async def count_for_page(collection, query: dict, include_total: bool) -> Optional[int]:
+    """Total for paginated lists: skipped when the caller opts out, read from
+    collection metadata when there is no filter"""
+    if not include_total:
+        return None
+    if not query:
+        return await collection.estimated_document_count()
+    return await collection.count_documents(query)
+
+def page_count(total: Optional[int], limit: int) -> Optional[int]:
+    return (total + limit - 1) // limit if total is not None else None
+
+async def aggregate_list(collection, pipeline: list, length: Optional[int] = None) -> list:
+    """Run an aggregation and collect up to `length` results (the async driver's aggregate is itself a coroutine)"""
+    cursor = await collection.aggregate(pipeline)
+    return await cursor.to_list(length)
+
 def generate_id(prefix: str = ""):
-    return f"{prefix}{uuid.uuid4().hex[:12]}"
+    return f"{prefix}{os.urandom(6).hex()}"
 
 def generate_referral_code():
-    return uuid.uuid4().hex[:8].upper()
+    return os.urandom(4).hex().upper()
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    """Hash off the event loop - bcrypt is CPU-bound and would stall other requests"""
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.hash, password)
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.verify, plain, hashed)
 
 def create_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
     to_encode = data.copy()
@@ -342,15 +918,17 @@ async def get_current_user(request: Request):
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await request.app.db.users.find_one({"user_id": user_id}, {"_id": 0})
+        user = await request.app.db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0, "credit_batches": 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         
         return user
-    except JWTError:
+    except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+@lru_cache(maxsize=None)
 def require_access_level(min_level: int):
+    """One shared dependency per level, so FastAPI resolves it once per request"""
     async def dependency(user: dict = Depends(get_current_user)):
         if user.get("access_level", 99) > min_level:
             raise HTTPException(status_code=403, detail="Access denied")
@@ -364,26 +942,31 @@ async def initialize_defaults(db):
         admin_user = {
             "user_id": generate_id("user_"),
             "email": "admin@vanguard.com",
-            "password": hash_password("admin123"),
+            "password": await hash_password("admin123"),
             "name": "Admin Técnico",
             "access_level": 0,
             "status": "active",
             "referral_code": generate_referral_code(),
             "sponsor_id": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "last_qualification": datetime.now(timezone.utc).isoformat(),
+            "ancestors": [],
+            "created_at": datetime.now(timezone.utc),
+            "last_qualification": datetime.now(timezone.utc),
             "personal_volume": 0,
             "team_volume": 0,
             "available_balance": 0,
             "blocked_balance": 0,
             "points": 0,
-            "hierarchy_level": 0
+            "hierarchy_level": 0,
+            "direct_referrals_count": 0,
+            "sales_by_month": {},
+            "commissions_by_month": {},
+            "unread_notifications": 0
         }
         await db.users.insert_one(admin_user)
         logger.info("Default admin created: admin@vanguard.com / admin123")
     
     # Create default settings if not exists
-    settings = await db.settings.find_one({"settings_id": "global"})
+    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
     if not settings:
         default_settings = {
             "settings_id": "global",
@@ -404,10 +987,207 @@ async def initialize_defaults(db):
             "mercadopago_enabled": False,
             "mercadopago_sandbox": True,
             "resend_enabled": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.settings.insert_one(default_settings)
+        default_settings.pop("_id", None)
+        settings = default_settings
         logger.info("Default settings created")
+    
+    # Warm the settings cache so the first requests after startup skip the read
+    prime_settings_cache(settings)
+
+# Date fields that used to be stored as ISO-8601 strings, now native BSON dates
+LEGACY_DATE_FIELDS = {
+    "users": ["created_at", "updated_at", "deleted_at", "last_qualification"],
+    "orders": ["created_at", "paid_at", "shipped_at", "delivered_at", "cancelled_at"],
+    "commissions": ["created_at", "release_at", "released_at", "reversed_at"],
+    "transactions": ["created_at"],
+    "withdrawals": ["created_at", "processed_at", "paid_at"],
+    "logs": ["created_at"],
+    "goals": ["start_date", "end_date", "created_at", "updated_at", "processed_at"],
+    "achievements": ["achieved_at"],
+    "referral_clicks": ["created_at"],
+    "settings": ["created_at", "updated_at"],
+    "invites": ["created_at", "expires_at"],
+    "products": ["created_at", "updated_at"],
+    "notifications": ["created_at", "read_at"],
+    "tickets": ["created_at", "updated_at"],
+    "ticket_replies": ["created_at"],
+    "conversations": ["created_at", "last_message_at"],
+    "messages": ["created_at", "read_at"],
+    "push_subscriptions": ["created_at"],
+}
+
+async def migrate_string_dates(db):
+    """Convert legacy ISO-string date fields to BSON dates"""
+    # Every writer stores datetimes now, so once a field has been converted it stays
+    # converted; record it to skip the unindexed $type scan on later startups
+    done = {
+        (m["collection"], m["field"])
+        async for m in db.migrations.find({"migration": "string_dates"}, {"_id": 0, "collection": 1, "field": 1})
+    }
+    for collection_name, fields in LEGACY_DATE_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            if (collection_name, field) in done:
+                continue
+            ops = []
+            async for doc in collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1}):
+                try:
+                    value = parse_datetime(doc[field])
+                except ValueError:
+                    logger.warning(f"Unparseable {collection_name}.{field} on {doc['_id']}: {doc[field]!r}")
+                    continue
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: value}}))
+                if len(ops) >= 1000:
+                    await collection.bulk_write(ops, ordered=False)
+                    ops = []
+            if ops:
+                await collection.bulk_write(ops, ordered=False)
+            await db.migrations.update_one(
+                {"migration": "string_dates", "collection": collection_name, "field": field},
+                {"$set": {"completed_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+
+async def run_data_migrations(db):
+    """Backfill derived fields on documents created before they existed"""
+    await migrate_string_dates(db)
+    
+    # direct_referrals_count: number of non-cancelled users whose sponsor_id points at this user
+    if await db.users.count_documents({"direct_referrals_count": {"$exists": False}}, limit=1):
+        await db.users.update_many({}, {"$set": {"direct_referrals_count": 0}})
+        async for doc in await db.users.aggregate([
+            {"$match": {"sponsor_id": {"$ne": None}, "status": {"$ne": "cancelled"}}},
+            {"$group": {"_id": "$sponsor_id", "count": {"$sum": 1}}}
+        ]):
+            await db.users.update_one({"user_id": doc["_id"]}, {"$set": {"direct_referrals_count": doc["count"]}})
+        logger.info("Backfilled direct_referrals_count")
+    
+    # sales_by_month / commissions_by_month: per-month counters used for goal progress
+    if await db.users.count_documents({"sales_by_month": {"$exists": False}}, limit=1):
+        await db.users.update_many({}, {"$set": {"sales_by_month": {}, "commissions_by_month": {}}})
+        for collection, user_field, value_field, counter, match in [
+            (db.orders, "$referrer_id", "$total", "sales_by_month", {"payment_status": "paid", "referrer_id": {"$ne": None}}),
+            (db.commissions, "$user_id", "$amount", "commissions_by_month", {}),
+        ]:
+            ops = []
+            async for doc in await collection.aggregate([
+                {"$match": match},
+                {"$group": {
+                    "_id": {"user_id": user_field, "month": {"$dateToString": {"format": "%Y%m", "date": "$created_at"}}},
+                    "total": {"$sum": value_field}
+                }}
+            ]):
+                ops.append(UpdateOne(
+                    {"user_id": doc["_id"]["user_id"]},
+                    {"$set": {f"{counter}.{doc['_id']['month']}": doc["total"]}}
+                ))
+            if ops:
+                await db.users.bulk_write(ops, ordered=False)
+        logger.info("Backfilled sales_by_month / commissions_by_month")
+    
+    # unread_notifications: number of unread in-app notifications
+    if await db.users.count_documents({"unread_notifications": {"$exists": False}}, limit=1):
+        await db.users.update_many({}, {"$set": {"unread_notifications": 0}})
+        ops = [
+            UpdateOne({"user_id": doc["_id"]}, {"$set": {"unread_notifications": doc["count"]}})
+            async for doc in await db.notifications.aggregate([
+                {"$match": {"read": False}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+            ])
+        ]
+        if ops:
+            await db.users.bulk_write(ops, ordered=False)
+        logger.info("Backfilled unread_notifications")
+    
+    # ancestors: sponsor chain, root first, ending with the direct sponsor
+    if await db.users.count_documents({"ancestors": {"$exists": False}}, limit=1):
+        ops = []
+        async for doc in await db.users.aggregate([
+            {"$match": {"ancestors": {"$exists": False}}},
+            {"$graphLookup": {
+                "from": "users",
+                "startWith": "$sponsor_id",
+                "connectFromField": "sponsor_id",
+                "connectToField": "user_id",
+                "as": "chain",
+                "depthField": "depth"
+            }},
+            {"$project": {"_id": 0, "user_id": 1, "chain.user_id": 1, "chain.depth": 1}}
+        ]):
+            chain = sorted(doc["chain"], key=lambda u: u["depth"], reverse=True)
+            ops.append(UpdateOne({"user_id": doc["user_id"]}, {"$set": {"ancestors": [u["user_id"] for u in chain]}}))
+            if len(ops) >= 1000:
+                await db.users.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await db.users.bulk_write(ops, ordered=False)
+        logger.info("Backfilled ancestors")
+
+def ancestors_under(sponsor: Optional[dict]) -> List[str]:
+    """Ancestor path for a user placed directly under sponsor"""
+    if not sponsor:
+        return []
+    return sponsor.get("ancestors", []) + [sponsor["user_id"]]
+
+async def reparent_downline(db, user_id: str, ancestors: List[str]):
+    """Rewrite the ancestor paths (and hierarchy levels) of user_id's downline after user_id
+    moved to `ancestors`"""
+    await db.users.update_many(
+        {"ancestors": user_id},
+        [
+            {"$set": {"ancestors": {"$concatArrays": [
+                {"$literal": ancestors + [user_id]},
+                {"$slice": [
+                    "$ancestors",
+                    {"$add": [{"$indexOfArray": ["$ancestors", user_id]}, 1]},
+                    {"$max": [{"$size": "$ancestors"}, 1]}
+                ]}
+            ]}}},
+            {"$set": {"hierarchy_level": {"$size": "$ancestors"}}}
+        ]
+    )
+
+async def cancel_resellers(db, user_ids: List[str]):
+    """Cancel resellers and move their downline up to the nearest ancestor that was not cancelled"""
+    if not user_ids:
+        return
+    affected_sponsors = await db.users.distinct("sponsor_id", {"user_id": {"$in": user_ids}, "sponsor_id": {"$ne": None}})
+    await db.users.update_many(
+        {"user_id": {"$in": user_ids}},
+        {"$set": {"status": "cancelled", "direct_referrals_count": 0}}
+    )
+    
+    # One pipeline update for the whole downline: drop the cancelled ids from each path,
+    # re-point members whose sponsor was cancelled at the last remaining ancestor, and
+    # keep hierarchy_level equal to the depth of the shortened path
+    sponsor_cancelled = {"$in": ["$sponsor_id", user_ids]}
+    await db.users.update_many({"ancestors": {"$in": user_ids}}, [
+        {"$set": {"ancestors": {"$filter": {"input": "$ancestors", "cond": {"$not": [{"$in": ["$$this", user_ids]}]}}}}},
+        {"$set": {
+            "sponsor_id": {"$cond": [sponsor_cancelled, {"$ifNull": [{"$arrayElemAt": ["$ancestors", -1]}, None]}, "$sponsor_id"]},
+            "hierarchy_level": {"$size": "$ancestors"}
+        }}
+    ])
+    await refresh_direct_referrals_count(db, affected_sponsors)
+
+async def refresh_direct_referrals_count(db, user_ids):
+    """Recount direct referrals for the given sponsors"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    counts = {user_id: 0 for user_id in user_ids}
+    async for doc in await db.users.aggregate([
+        {"$match": {"sponsor_id": {"$in": user_ids}, "status": {"$ne": "cancelled"}}},
+        {"$group": {"_id": "$sponsor_id", "count": {"$sum": 1}}}
+    ]):
+        counts[doc["_id"]] = doc["count"]
+    await db.users.bulk_write(
+        [UpdateOne({"user_id": uid}, {"$set": {"direct_referrals_count": c}}) for uid, c in counts.items()],
+        ordered=False
+    )
 
 # ==================== AUTH ROUTES ====================
 
@@ -415,27 +1195,29 @@ async def initialize_defaults(db):
 async def register(request: Request, data: UserRegister):
     db = request.app.db
     
-    existing = await db.users.find_one({"email": data.email})
+    existing = await db.users.find_one({"email": data.email}, {"_id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     sponsor_id = None
+    ancestors = []
     hierarchy_level = 0
     
     # Handle sponsor for revendedores
     if data.sponsor_code and data.access_level == 4:
-        sponsor = await db.users.find_one({"referral_code": data.sponsor_code}, {"_id": 0})
+        sponsor = await db.users.find_one({"referral_code": data.sponsor_code}, {"_id": 0, "user_id": 1, "access_level": 1, "hierarchy_level": 1, "ancestors": 1})
         if not sponsor:
             raise HTTPException(status_code=400, detail="Invalid sponsor code")
         if sponsor.get("access_level") not in [3, 4]:
             raise HTTPException(status_code=400, detail="Sponsor must be a reseller or team leader")
         sponsor_id = sponsor["user_id"]
+        ancestors = ancestors_under(sponsor)
         hierarchy_level = sponsor.get("hierarchy_level", 0) + 1
     
     user = {
         "user_id": generate_id("user_"),
         "email": data.email,
-        "password": hash_password(data.password),
+        "password": await hash_password(data.password),
         "name": data.name,
         "phone": data.phone,
         "cpf": data.cpf,
@@ -443,14 +1225,19 @@ async def register(request: Request, data: UserRegister):
         "status": "active",
         "referral_code": generate_referral_code(),
         "sponsor_id": sponsor_id,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "last_qualification": datetime.now(timezone.utc).isoformat() if data.access_level == 4 else None,
+        "ancestors": ancestors,
+        "created_at": datetime.now(timezone.utc),
+        "last_qualification": datetime.now(timezone.utc) if data.access_level == 4 else None,
         "personal_volume": 0,
         "team_volume": 0,
         "available_balance": 0,
         "blocked_balance": 0,
         "points": 0,
         "hierarchy_level": hierarchy_level,
+        "direct_referrals_count": 0,
+        "sales_by_month": {},
+        "commissions_by_month": {},
+        "unread_notifications": 0,
         "ambassador_commission": 5 if data.access_level == 6 else None,
         "address": None,
         "bank_info": None
@@ -458,19 +1245,22 @@ async def register(request: Request, data: UserRegister):
     
     await db.users.insert_one(user)
     
+    if sponsor_id:
+        await db.users.update_one({"user_id": sponsor_id}, {"$inc": {"direct_referrals_count": 1}})
+    
     # Log action
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "user_registered",
         "user_id": user["user_id"],
         "details": {"email": data.email, "access_level": data.access_level},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     token = create_token({"user_id": user["user_id"]})
     
-    # Re-fetch user without _id to avoid serialization issues
-    user_response = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0, "password": 0})
+    # insert_one added an ObjectId _id to the dict; respond from what we already have
+    user_response = {k: v for k, v in user.items() if k not in ("_id", "password")}
     
     return {"token": token, "user": user_response}
 
@@ -478,8 +1268,8 @@ async def register(request: Request, data: UserRegister):
 async def login(request: Request, response: Response, data: UserLogin):
     db = request.app.db
     
-    user = await db.users.find_one({"email": data.email}, {"_id": 0})
-    if not user or not verify_password(data.password, user["password"]):
+    user = await db.users.find_one({"email": data.email}, {"_id": 0, "credit_batches": 0})
+    if not user or not await verify_password(data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if user.get("status") == "cancelled":
@@ -521,11 +1311,10 @@ async def handle_session(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="Session ID required")
     
     # Call Emergent Auth to get user data
-    async with httpx.AsyncClient() as client:
-        auth_response = await client.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id}
-        )
+    auth_response = await request.app.http.get(
+        "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+        headers={"X-Session-ID": session_id}
+    )
     
     if auth_response.status_code != 200:
         raise HTTPException(status_code=401, detail="Invalid session")
@@ -538,7 +1327,7 @@ async def handle_session(request: Request, response: Response):
     db = request.app.db
     
     # Check if user exists
-    user = await db.users.find_one({"email": email}, {"_id": 0})
+    user = await db.users.find_one({"email": email}, {"_id": 0, "credit_batches": 0})
     
     if not user:
         # Create new user as Cliente
@@ -554,7 +1343,8 @@ async def handle_session(request: Request, response: Response):
             "status": "active",
             "referral_code": generate_referral_code(),
             "sponsor_id": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "ancestors": [],
+            "created_at": datetime.now(timezone.utc),
             "last_qualification": None,
             "personal_volume": 0,
             "team_volume": 0,
@@ -562,18 +1352,24 @@ async def handle_session(request: Request, response: Response):
             "blocked_balance": 0,
             "points": 0,
             "hierarchy_level": 0,
+            "direct_referrals_count": 0,
+            "sales_by_month": {},
+            "commissions_by_month": {},
+            "unread_notifications": 0,
             "ambassador_commission": None,
             "address": None,
             "bank_info": None
         }
         await db.users.insert_one(user)
+        user.pop("_id", None)
     else:
         # Update user info
         await db.users.update_one(
             {"email": email},
             {"$set": {"name": name, "picture": picture}}
         )
-        user = await db.users.find_one({"email": email}, {"_id": 0})
+        user["name"] = name
+        user["picture"] = picture
     
     token = create_token({"user_id": user["user_id"]})
     
@@ -623,15 +1419,28 @@ async def list_users(
         else:
             query["access_level"] = {"$in": [4, 5, 6]}
     
-    total = await db.users.count_documents(query)
-    users = await db.users.find(query, {"_id": 0, "password": 0}).skip((page-1)*limit).limit(limit).to_list(limit)
+    # Page and total count in one round trip
+    result = await aggregate_list(db.users, [
+        {"$match": query},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "users": [
+                {"$skip": (page-1)*limit},
+                {"$limit": limit},
+                {"$project": {"_id": 0, "password": 0, "credit_batches": 0}}
+            ]
+        }}
+    ], 1)
+    
+    users = result[0]["users"]
+    total = result[0]["total"][0]["count"] if result[0]["total"] else 0
     
     return {"users": users, "total": total, "page": page, "pages": (total + limit - 1) // limit}
 
 @app.get("/api/users/{user_id}")
 async def get_user(request: Request, user_id: str, user: dict = Depends(require_access_level(2))):
     db = request.app.db
-    target_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
+    target_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0, "credit_batches": 0})
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
     return target_user
@@ -642,7 +1451,10 @@ async def get_user(request: Request, user_id: str, user: dict = Depends(require_
 async def convert_user(request: Request, data: ConvertUserRequest, user: dict = Depends(require_access_level(1))):
     db = request.app.db
     
-    target_user = await db.users.find_one({"user_id": data.user_id}, {"_id": 0})
+    target_user = await db.users.find_one(
+        {"user_id": data.user_id},
+        {"_id": 0, "access_level": 1, "sponsor_id": 1}
+    )
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -653,13 +1465,14 @@ async def convert_user(request: Request, data: ConvertUserRequest, user: dict =
         if not data.sponsor_code:
             raise HTTPException(status_code=400, detail="Sponsor code required for reseller")
         
-        sponsor = await db.users.find_one({"referral_code": data.sponsor_code}, {"_id": 0})
+        sponsor = await db.users.find_one({"referral_code": data.sponsor_code}, {"_id": 0, "user_id": 1, "access_level": 1, "hierarchy_level": 1, "ancestors": 1})
         if not sponsor or sponsor.get("access_level") not in [3, 4]:
             raise HTTPException(status_code=400, detail="Invalid sponsor")
         
         update_data["sponsor_id"] = sponsor["user_id"]
+        update_data["ancestors"] = ancestors_under(sponsor)
         update_data["hierarchy_level"] = sponsor.get("hierarchy_level", 0) + 1
-        update_data["last_qualification"] = datetime.now(timezone.utc).isoformat()
+        update_data["last_qualification"] = datetime.now(timezone.utc)
     
     # If promoting to leader
     if data.new_access_level == 3:
@@ -668,23 +1481,33 @@ async def convert_user(request: Request, data: ConvertUserRequest, user: dict =
     
     await db.users.update_one({"user_id": data.user_id}, {"$set": update_data})
     
-    await db.logs.insert_one({
+    # Keep sponsors' direct referral counters in sync
+    old_sponsor_id = target_user.get("sponsor_id")
+    new_sponsor_id = update_data.get("sponsor_id", old_sponsor_id)
+    if new_sponsor_id != old_sponsor_id:
+        if old_sponsor_id:
+            await db.users.update_one({"user_id": old_sponsor_id}, {"$inc": {"direct_referrals_count": -1}})
+        if new_sponsor_id:
+            await db.users.update_one({"user_id": new_sponsor_id}, {"$inc": {"direct_referrals_count": 1}})
+        await reparent_downline(db, data.user_id, update_data["ancestors"])
+    
+    log_event({
         "log_id": generate_id("log_"),
         "action": "user_converted",
         "user_id": data.user_id,
         "by_user_id": user["user_id"],
         "details": {"old_level": target_user.get("access_level"), "new_level": data.new_access_level},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    updated = await db.users.find_one({"user_id": data.user_id}, {"_id": 0, "password": 0})
+    updated = await db.users.find_one({"user_id": data.user_id}, {"_id": 0, "password": 0, "credit_batches": 0})
     return updated
 
 @app.post("/api/users/invite")
 async def invite_user(request: Request, data: InviteRequest, user: dict = Depends(require_access_level(1))):
     db = request.app.db
     
-    existing = await db.users.find_one({"email": data.email})
+    existing = await db.users.find_one({"email": data.email}, {"_id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="User already exists")
     
@@ -695,8 +1518,8 @@ async def invite_user(request: Request, data: InviteRequest, user: dict = Depend
         "target_level": data.target_level,
         "invited_by": user["user_id"],
         "status": "pending",
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=7)
     }
     
     await db.invites.insert_one(invite)
@@ -720,7 +1543,7 @@ async def send_reseller_invite(request: Request, data: ResellerInviteRequest, us
         raise HTTPException(status_code=403, detail="Only resellers and leaders can invite new resellers")
     
     # Check if user already exists
-    existing = await db.users.find_one({"email": data.email})
+    existing = await db.users.find_one({"email": data.email}, {"_id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="Este email já está cadastrado no sistema")
     
@@ -728,7 +1551,7 @@ async def send_reseller_invite(request: Request, data: ResellerInviteRequest, us
     existing_invite = await db.invites.find_one({
         "email": data.email,
         "status": "pending"
-    })
+    }, {"_id": 1})
     if existing_invite:
         raise HTTPException(status_code=400, detail="Já existe um convite pendente para este email")
     
@@ -741,29 +1564,29 @@ async def send_reseller_invite(request: Request, data: ResellerInviteRequest, us
         "sponsor_code": user.get("referral_code"),
         "type": data.type,
         "status": "pending",
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=30)
     }
     
     await db.invites.insert_one(invite)
     
     # Log the invite
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "reseller_invite_sent",
         "user_id": user["user_id"],
         "details": {"email": data.email, "name": data.name},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     # Send push notification to inviter confirming the invite was sent
-    await send_push_notification(
+    run_in_background(send_push_notification(
         db,
         user["user_id"],
         "Convite Enviado! 📩",
         f"Convite enviado para {data.name}. Aguarde a confirmação!",
         {"url": "/network", "type": "invite_sent"}
-    )
+    ))
     
     # TODO: Send email via Resend when configured
     
@@ -797,13 +1620,13 @@ async def set_ambassador_commission(request: Request, data: AmbassadorCommission
         {"$set": {"ambassador_commission": data.commission_rate}}
     )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "ambassador_commission_updated",
         "user_id": data.user_id,
         "by_user_id": user["user_id"],
         "details": {"commission_rate": data.commission_rate},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Commission updated"}
@@ -843,7 +1666,7 @@ async def update_user(
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Find the user to update
-    target_user = await db.users.find_one({"user_id": user_id})
+    target_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "sponsor_id": 1})
     if not target_user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
@@ -866,12 +1689,12 @@ async def update_user(
     if is_admin:
         if data.email is not None:
             # Check if email is already in use by another user
-            existing = await db.users.find_one({"email": data.email, "user_id": {"$ne": user_id}})
+            existing = await db.users.find_one({"email": data.email, "user_id": {"$ne": user_id}}, {"_id": 1})
             if existing:
                 raise HTTPException(status_code=400, detail="Email já está em uso")
             update_data["email"] = data.email
         if data.password:
-            update_data["password"] = pwd_context.hash(data.password)
+            update_data["password"] = await hash_password(data.password)
         if data.access_level is not None:
             update_data["access_level"] = data.access_level
         if data.status is not None:
@@ -885,7 +1708,7 @@ async def update_user(
         if data.supervisor_id is not None:
             # Validate supervisor exists and is a supervisor (level 2)
             if data.supervisor_id:
-                supervisor = await db.users.find_one({"user_id": data.supervisor_id})
+                supervisor = await db.users.find_one({"user_id": data.supervisor_id}, {"_id": 0, "access_level": 1})
                 if not supervisor:
                     raise HTTPException(status_code=400, detail="Supervisor não encontrado")
                 if supervisor.get("access_level") != 2:
@@ -895,21 +1718,25 @@ async def update_user(
     if not update_data:
         raise HTTPException(status_code=400, detail="Nenhum campo para atualizar")
     
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
     await db.users.update_one({"user_id": user_id}, {"$set": update_data})
     
+    # The sponsor's direct referral count leaves out cancelled users
+    if target_user.get("sponsor_id") and ("status" in update_data or "access_level" in update_data):
+        await refresh_direct_referrals_count(db, [target_user["sponsor_id"]])
+    
     # Log the action
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "user_updated",
         "user_id": user_id,
         "by_user_id": current_user["user_id"],
         "details": {k: v for k, v in update_data.items() if k != "password"},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    updated_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
+    updated_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password": 0, "credit_batches": 0})
     return updated_user
 
 @app.delete("/api/users/{user_id}")
@@ -921,27 +1748,31 @@ async def delete_user(
     """Delete user (Admin Técnico only)"""
     db = request.app.db
     
-    target_user = await db.users.find_one({"user_id": user_id})
-    if not target_user:
-        raise HTTPException(status_code=404, detail="Usuário não encontrado")
-    
     # Don't allow deleting yourself
     if user_id == current_user["user_id"]:
         raise HTTPException(status_code=400, detail="Você não pode excluir sua própria conta")
     
-    # Soft delete - just change status to cancelled
-    await db.users.update_one(
-        {"user_id": user_id}, 
-        {"$set": {"status": "cancelled", "deleted_at": datetime.now(timezone.utc).isoformat()}}
+    # Soft delete - just change status to cancelled; the previous document tells
+    # whether this request is the one that cancelled the user
+    target_user = await db.users.find_one_and_update(
+        {"user_id": user_id},
+        {"$set": {"status": "cancelled", "deleted_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "name": 1, "email": 1, "sponsor_id": 1, "status": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if not target_user:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
     
-    await db.logs.insert_one({
+    if target_user.get("sponsor_id") and target_user.get("status") != "cancelled":
+        await db.users.update_one({"user_id": target_user["sponsor_id"]}, {"$inc": {"direct_referrals_count": -1}})
+    
+    log_event({
         "log_id": generate_id("log_"),
         "action": "user_deleted",
         "user_id": user_id,
         "by_user_id": current_user["user_id"],
         "details": {"name": target_user.get("name"), "email": target_user.get("email")},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Usuário excluído"}
@@ -952,61 +1783,55 @@ async def delete_user(
 async def get_network_tree(request: Request, user: dict = Depends(get_current_user)):
     db = request.app.db
     
-    async def build_tree(user_id: str, depth: int = 0, max_depth: int = 3):
-        if depth >= max_depth:
-            return []
-        
-        children = await db.users.find(
-            {"sponsor_id": user_id, "access_level": {"$in": [3, 4]}},
-            {"_id": 0, "password": 0}
-        ).to_list(100)
-        
-        result = []
-        for child in children:
-            child["children"] = await build_tree(child["user_id"], depth + 1, max_depth)
-            result.append(child)
-        
-        return result
-    
-    # For admins, show full network from top
+    # Roots plus up to 3 levels of reseller/leader downline in one aggregation,
+    # nested in Python from the flat descendants list
     if user.get("access_level") <= 1:
-        root_users = await db.users.find(
-            {"sponsor_id": None, "access_level": {"$in": [3, 4]}},
-            {"_id": 0, "password": 0}
-        ).to_list(100)
-        
-        for root in root_users:
-            root["children"] = await build_tree(root["user_id"])
-        
-        return {"tree": root_users}
-    
-    # For resellers/leaders, show their own network
-    user_data = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0, "password": 0})
-    user_data["children"] = await build_tree(user["user_id"])
-    
-    return {"tree": [user_data]}
+        # For admins, show full network from top
+        root_match = {"sponsor_id": None, "access_level": {"$in": [3, 4]}}
+    else:
+        # For resellers/leaders, show their own network
+        root_match = {"user_id": user["user_id"]}
+    
+    roots = await aggregate_list(db.users, [
+        {"$match": root_match},
+        {"$limit": 100},
+        {"$graphLookup": {
+            "from": "users",
+            "startWith": "$user_id",
+            "connectFromField": "user_id",
+            "connectToField": "sponsor_id",
+            "as": "descendants",
+            "maxDepth": 2,
+            "restrictSearchWithMatch": {"access_level": {"$in": [3, 4]}}
+        }},
+        {"$project": {"_id": 0, "password": 0, "credit_batches": 0, "descendants._id": 0, "descendants.password": 0, "descendants.credit_batches": 0}}
+    ], 100)
+    
+    # Every node appears once, so linking each to its child list builds the tree
+    # in a single pass without recursion
+    for root in roots:
+        members = root.pop("descendants")
+        children_of = {}
+        for member in members:
+            children_of.setdefault(member["sponsor_id"], []).append(member)
+        for node in [root, *members]:
+            node["children"] = children_of.get(node["user_id"], [])[:100]
+    
+    return {"tree": roots}
 
 @app.get("/api/network/upline/{user_id}")
 async def get_upline(request: Request, user_id: str, user: dict = Depends(get_current_user)):
     db = request.app.db
     
-    upline = []
-    current_id = user_id
+    # Up to 3 sponsors off the user's ancestor path, direct sponsor first
+    member = await db.users.find_one({"user_id": user_id}, {"_id": 0, "ancestors": 1})
+    ancestor_ids = list(reversed(member.get("ancestors", [])[-3:])) if member else []
     
-    for _ in range(3):  # Max 3 levels up
-        current_user = await db.users.find_one({"user_id": current_id}, {"_id": 0, "password": 0})
-        if not current_user or not current_user.get("sponsor_id"):
-            break
-        
-        sponsor = await db.users.find_one(
-            {"user_id": current_user["sponsor_id"]},
-            {"_id": 0, "password": 0}
-        )
-        if sponsor:
-            upline.append(sponsor)
-            current_id = sponsor["user_id"]
-        else:
-            break
+    sponsors = {}
+    if ancestor_ids:
+        async for sponsor in db.users.find({"user_id": {"$in": ancestor_ids}}, {"_id": 0, "password": 0, "credit_batches": 0}):
+            sponsors[sponsor["user_id"]] = sponsor
+    upline = [sponsors[uid] for uid in ancestor_ids if uid in sponsors]
     
     return {"upline": upline}
 
@@ -1016,31 +1841,53 @@ async def get_network_stats(request: Request, user: dict = Depends(get_current_u
     
     user_id = user["user_id"]
     
-    # Count direct referrals
-    level_1 = await db.users.count_documents({"sponsor_id": user_id, "access_level": {"$in": [3, 4]}})
-    
-    # Count level 2
-    level_1_ids = [u["user_id"] for u in await db.users.find({"sponsor_id": user_id}, {"user_id": 1}).to_list(100)]
-    level_2 = await db.users.count_documents({"sponsor_id": {"$in": level_1_ids}, "access_level": {"$in": [3, 4]}}) if level_1_ids else 0
+    def count_where(cond):
+        return {"$size": {"$filter": {"input": "$net", "as": "m", "cond": cond}}}
     
-    # Count level 3
-    level_2_ids = [u["user_id"] for u in await db.users.find({"sponsor_id": {"$in": level_1_ids}}, {"user_id": 1}).to_list(100)] if level_1_ids else []
-    level_3 = await db.users.count_documents({"sponsor_id": {"$in": level_2_ids}, "access_level": {"$in": [3, 4]}}) if level_2_ids else 0
+    # Three levels of reseller/leader downline in one aggregation, counted server-side
+    stats = await aggregate_list(db.users, [
+        {"$match": {"user_id": user_id}},
+        {"$graphLookup": {
+            "from": "users",
+            "startWith": "$user_id",
+            "connectFromField": "user_id",
+            "connectToField": "sponsor_id",
+            "as": "net",
+            "maxDepth": 2,
+            "depthField": "lvl",
+            "restrictSearchWithMatch": {"access_level": {"$in": [3, 4]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "level_1": count_where({"$eq": ["$$m.lvl", 0]}),
+            "level_2": count_where({"$eq": ["$$m.lvl", 1]}),
+            "level_3": count_where({"$eq": ["$$m.lvl", 2]}),
+            "active_this_month": count_where({"$and": [
+                {"$eq": ["$$m.lvl", 0]},
+                {"$eq": ["$$m.status", "active"]},
+                {"$gte": ["$$m.last_qualification", current_month_start()]}
+            ]})
+        }}
+    ], 1)
+    stats = stats[0] if stats else {"level_1": 0, "level_2": 0, "level_3": 0, "active_this_month": 0}
     
     return {
-        "total_network": level_1 + level_2 + level_3,
-        "level_1": level_1,
-        "level_2": level_2,
-        "level_3": level_3,
-        "active_this_month": await db.users.count_documents({
-            "sponsor_id": user_id,
-            "status": "active",
-            "last_qualification": {"$gte": datetime.now(timezone.utc).replace(day=1).isoformat()}
-        })
+        "total_network": stats["level_1"] + stats["level_2"] + stats["level_3"],
+        "level_1": stats["level_1"],
+        "level_2": stats["level_2"],
+        "level_3": stats["level_3"],
+        "active_this_month": stats["active_this_month"]
     }
 
 # ==================== PRODUCTS ====================
 
+# Category list cache - refreshed every 60s and dropped whenever a product is written
+CATEGORIES_CACHE_TTL = 60
+_categories_cache = {"value": None, "ts": 0.0}
+
+def invalidate_categories_cache():
+    _categories_cache["value"] = None
+
 @app.get("/api/products")
 async def list_products(
     request: Request,
@@ -1048,7 +1895,8 @@ async def list_products(
     active: bool = True,
     search: Optional[str] = None,
     page: int = 1,
-    limit: int = 20
+    limit: int = 20,
+    include_total: bool = True
 ):
     db = request.app.db
     query = {}
@@ -1058,15 +1906,19 @@ async def list_products(
     if category:
         query["category"] = category
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+        # Backed by the products text index; best matches first
+        query["$text"] = {"$search": search}
     
-    total = await db.products.count_documents(query)
-    products = await db.products.find(query, {"_id": 0}).skip((page-1)*limit).limit(limit).to_list(limit)
+    cursor = db.products.find(query, {"_id": 0})
+    if search:
+        cursor = cursor.sort([("score", {"$meta": "textScore"})])
+    total, products = await asyncio.gather(
+        count_for_page(db.products, query, include_total),
+        cursor.skip((page-1)*limit).limit(limit + 1).to_list(limit + 1)
+    )
+    has_more = len(products) > limit
     
-    return {"products": products, "total": total, "page": page, "pages": (total + limit - 1) // limit}
+    return {"products": products[:limit], "total": total, "page": page, "pages": page_count(total, limit), "has_more": has_more}
 
 @app.get("/api/products/{product_id}")
 async def get_product(request: Request, product_id: str):
@@ -1083,47 +1935,51 @@ async def create_product(request: Request, data: ProductCreate, user: dict = Dep
     product = {
         "product_id": generate_id("prod_"),
         **data.model_dump(),
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "created_by": user["user_id"]
     }
     
     await db.products.insert_one(product)
+    invalidate_categories_cache()
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "product_created",
         "user_id": user["user_id"],
         "details": {"product_id": product["product_id"], "name": data.name},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    # Re-fetch product without _id
-    product_response = await db.products.find_one({"product_id": product["product_id"]}, {"_id": 0})
-    return product_response
+    # insert_one added an ObjectId _id to the dict
+    product.pop("_id", None)
+    return product
 
 @app.put("/api/products/{product_id}")
 async def update_product(request: Request, product_id: str, data: ProductCreate, user: dict = Depends(require_access_level(1))):
     db = request.app.db
     
-    existing = await db.products.find_one({"product_id": product_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
     update_data = data.model_dump()
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     update_data["updated_by"] = user["user_id"]
     
-    await db.products.update_one({"product_id": product_id}, {"$set": update_data})
+    updated = await db.products.find_one_and_update(
+        {"product_id": product_id},
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Product not found")
+    invalidate_categories_cache()
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "product_updated",
         "user_id": user["user_id"],
         "details": {"product_id": product_id},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    updated = await db.products.find_one({"product_id": product_id}, {"_id": 0})
     return updated
 
 @app.delete("/api/products/{product_id}")
@@ -1133,13 +1989,14 @@ async def delete_product(request: Request, product_id: str, user: dict = Depends
     result = await db.products.delete_one({"product_id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    invalidate_categories_cache()
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "product_deleted",
         "user_id": user["user_id"],
         "details": {"product_id": product_id},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Product deleted"}
@@ -1147,22 +2004,38 @@ async def delete_product(request: Request, product_id: str, user: dict = Depends
 @app.get("/api/categories")
 async def list_categories(request: Request):
     db = request.app.db
-    categories = await db.products.distinct("category")
-    return {"categories": categories}
+    if _categories_cache["value"] is None or time.monotonic() - _categories_cache["ts"] >= CATEGORIES_CACHE_TTL:
+        _categories_cache["value"] = await db.products.distinct("category")
+        _categories_cache["ts"] = time.monotonic()
+    return {"categories": _categories_cache["value"]}
 
 # ==================== ORDERS ====================
 
 @app.post("/api/orders")
 async def create_order(request: Request, data: OrderCreate, user: dict = Depends(get_current_user)):
     db = request.app.db
-    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
+    
+    if not data.items:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    
+    # Products and referrer are independent lookups, so fetch them concurrently
+    product_ids = list({item["product_id"] for item in data.items})
+    product_docs, referrer = await asyncio.gather(
+        db.products.find(
+            {"product_id": {"$in": product_ids}},
+            {"_id": 0, "product_id": 1, "name": 1, "price": 1, "discount_price": 1}
+        ).to_list(len(product_ids)),
+        db.users.find_one({"referral_code": data.referral_code}, {"_id": 0, "user_id": 1, "access_level": 1})
+        if data.referral_code else asyncio.sleep(0)
+    )
+    products = {p["product_id"]: p for p in product_docs}
     
     # Calculate totals
     subtotal = 0
     order_items = []
     
     for item in data.items:
-        product = await db.products.find_one({"product_id": item["product_id"]}, {"_id": 0})
+        product = products.get(item["product_id"])
         if not product:
             raise HTTPException(status_code=400, detail=f"Product {item['product_id']} not found")
         
@@ -1183,11 +2056,9 @@ async def create_order(request: Request, data: OrderCreate, user: dict = Depends
     referrer_id = None
     referrer_type = None
     
-    if data.referral_code:
-        referrer = await db.users.find_one({"referral_code": data.referral_code}, {"_id": 0})
-        if referrer:
-            referrer_id = referrer["user_id"]
-            referrer_type = ACCESS_LEVELS.get(referrer.get("access_level"), "unknown")
+    if referrer:
+        referrer_id = referrer["user_id"]
+        referrer_type = ACCESS_LEVELS.get(referrer.get("access_level"), "unknown")
     
     # Calculate shipping (simplified - should integrate with carrier API)
     shipping = 15.0  # Placeholder
@@ -1206,7 +2077,7 @@ async def create_order(request: Request, data: OrderCreate, user: dict = Depends
         "order_status": "pending",
         "referrer_id": referrer_id,
         "referrer_type": referrer_type,
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "paid_at": None,
         "shipped_at": None,
         "delivered_at": None,
@@ -1214,10 +2085,11 @@ async def create_order(request: Request, data: OrderCreate, user: dict = Depends
     }
     
     await db.orders.insert_one(order)
+    invalidate_dashboard_cache()
     
-    # Re-fetch order without _id
-    order_response = await db.orders.find_one({"order_id": order["order_id"]}, {"_id": 0})
-    return order_response
+    # insert_one added an ObjectId _id to the dict
+    order.pop("_id", None)
+    return order
 
 @app.get("/api/orders")
 async def list_orders(
@@ -1225,6 +2097,8 @@ async def list_orders(
     status: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
     user: dict = Depends(get_current_user)
 ):
     db = request.app.db
@@ -1237,10 +2111,12 @@ async def list_orders(
     if status:
         query["order_status"] = status
     
-    total = await db.orders.count_documents(query)
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip((page-1)*limit).limit(limit).to_list(limit)
+    total, (orders, next_cursor) = await asyncio.gather(
+        count_for_page(db.orders, query, include_total),
+        fetch_page(db.orders, query, page, limit, cursor)
+    )
     
-    return {"orders": orders, "total": total, "page": page, "pages": (total + limit - 1) // limit}
+    return {"orders": orders, "total": total, "page": page, "pages": page_count(total, limit), "has_more": next_cursor is not None, "next_cursor": next_cursor}
 
 @app.get("/api/orders/{order_id}")
 async def get_order(request: Request, order_id: str, user: dict = Depends(get_current_user)):
@@ -1264,50 +2140,72 @@ async def update_order_status(
     user: dict = Depends(require_access_level(2))
 ):
     db = request.app.db
-    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
-    
-    order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
+    now = datetime.now(timezone.utc)
     update_data = {"order_status": status}
+    # Check-and-set: the transition only applies if the order is not already there, so
+    # two concurrent requests cannot both pay (or cancel) it and run the side effects twice
+    transition_filter = {"order_id": order_id, "order_status": {"$ne": status}}
     
     if status == "paid":
-        update_data["paid_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["paid_at"] = now
         update_data["payment_status"] = "paid"
-        
-        # Process commissions
-        await process_order_commissions(db, order, settings)
-    
+        # Set once commissions, balances and volumes are applied (see apply_paid_order)
+        update_data["commissions_processed"] = False
+        transition_filter["payment_status"] = {"$ne": "paid"}
     elif status == "shipped":
-        update_data["shipped_at"] = datetime.now(timezone.utc).isoformat()
-    
+        update_data["shipped_at"] = now
     elif status == "delivered":
-        update_data["delivered_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["delivered_at"] = now
+    elif status == "cancelled":
+        update_data["cancelled_at"] = now
+    
+    # The previous version of the order drives the side effects below
+    settings, order = await asyncio.gather(
+        get_cached_settings(db),
+        db.orders.find_one_and_update(
+            transition_filter,
+            {"$set": update_data},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+    )
+    if not order:
+        order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        # Retrying "paid" finishes the side effects an interrupted attempt left undone
+        if status != "paid" or order.get("commissions_processed") is not False:
+            raise HTTPException(status_code=409, detail=f"Order is already {status}")
+    
+    if status == "paid":
+        await apply_paid_order(db, order, settings)
     
     elif status == "cancelled":
-        update_data["cancelled_at"] = datetime.now(timezone.utc).isoformat()
-        
         # Reverse commissions if within 7 days
         if order.get("paid_at"):
-            paid_at = datetime.fromisoformat(order["paid_at"])
-            if datetime.now(timezone.utc) - paid_at <= timedelta(days=7):
+            if now - order["paid_at"] <= timedelta(days=7):
                 await reverse_order_commissions(db, order_id)
     
-    await db.orders.update_one({"order_id": order_id}, {"$set": update_data})
+    invalidate_dashboard_cache()
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "order_status_updated",
         "user_id": user["user_id"],
         "details": {"order_id": order_id, "new_status": status},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Order status updated"}
 
+async def apply_paid_order(db, order, settings):
+    """Side effects of paying an order, then mark it processed. Every write is keyed on the
+    order, so re-running this after a failure only fills in what is missing."""
+    await process_order_commissions(db, order, settings)
+    await db.orders.update_one({"order_id": order["order_id"]}, {"$set": {"commissions_processed": True}})
+
 async def process_order_commissions(db, order, settings):
-    """Process MLM commissions for an order"""
+    """Process MLM commissions, the referrer's sales counter and volumes for a paid order"""
     
     commission_base = order.get("commission_base", 0)
     referrer_id = order.get("referrer_id")
@@ -1317,64 +2215,48 @@ async def process_order_commissions(db, order, settings):
     if not referrer_id:
         return
     
-    referrer = await db.users.find_one({"user_id": referrer_id}, {"_id": 0})
-    if not referrer:
+    # Referrer plus the two sponsors above it (the tail of its ancestor path) in one query
+    chain = await aggregate_list(db.users, [
+        {"$match": {"user_id": referrer_id}},
+        {"$project": {"_id": 0, "user_id": 1, "status": 1, "ambassador_commission": 1, "ancestors": {"$slice": [{"$ifNull": ["$ancestors", []]}, -2]}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "ancestors",
+            "foreignField": "user_id",
+            "as": "upline",
+            "pipeline": [{"$project": {"_id": 0, "user_id": 1, "status": 1}}]
+        }}
+    ], 1)
+    if not chain:
         return
+    referrer = chain[0]
     
     commissions_created = []
-    release_at = (datetime.now(timezone.utc) + timedelta(days=bonus_block_days)).isoformat()
+    now = datetime.now(timezone.utc)
+    release_at = now + timedelta(days=bonus_block_days)
     
-    # Handle different referrer types
-    if referrer_type == "embaixador":
-        # Ambassador gets custom commission
-        rate = referrer.get("ambassador_commission", 5) / 100
-        amount = commission_base * rate
-        
-        commission = {
+    def add_commission(user_id: str, level: int, rate: float):
+        commissions_created.append({
             "commission_id": generate_id("comm_"),
             "order_id": order["order_id"],
-            "user_id": referrer_id,
-            "level": 0,
+            "user_id": user_id,
+            "level": level,
             "rate": rate * 100,
             "base_amount": commission_base,
-            "amount": amount,
+            "amount": commission_base * rate,
             "status": "blocked",
             "release_at": release_at,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.commissions.insert_one(commission)
-        
-        # Add to blocked balance
-        await db.users.update_one(
-            {"user_id": referrer_id},
-            {"$inc": {"blocked_balance": amount}}
-        )
-        commissions_created.append(commission)
+            "created_at": now
+        })
+    
+    # Handle different referrer types
+    if referrer_type == "embaixador":
+        # Ambassador gets custom commission
+        add_commission(referrer_id, 0, referrer.get("ambassador_commission", 5) / 100)
     
     elif referrer_type == "cliente":
         # Client referral gets single commission
-        rate = settings.get("client_referral_commission", 5) / 100
-        amount = commission_base * rate
-        
-        commission = {
-            "commission_id": generate_id("comm_"),
-            "order_id": order["order_id"],
-            "user_id": referrer_id,
-            "level": 0,
-            "rate": rate * 100,
-            "base_amount": commission_base,
-            "amount": amount,
-            "status": "blocked",
-            "release_at": release_at,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.commissions.insert_one(commission)
-        
-        await db.users.update_one(
-            {"user_id": referrer_id},
-            {"$inc": {"blocked_balance": amount}}
-        )
-        commissions_created.append(commission)
+        add_commission(referrer_id, 0, settings.get("client_referral_commission", 5) / 100)
     
     elif referrer_type in ["revendedor", "lider"]:
         # MLM commissions - up to 3 levels
@@ -1384,64 +2266,66 @@ async def process_order_commissions(db, order, settings):
             settings.get("commission_level_3", 5) / 100
         ]
         
-        current_user_id = referrer_id
-        
-        for level in range(3):
-            if not current_user_id:
+        # Walk up from the direct sponsor; a missing sponsor ends the chain, so the
+        # members above it are never shifted into a lower level's rate
+        upline = {u["user_id"]: u for u in referrer["upline"]}
+        levels = [referrer]
+        for uid in reversed(referrer["ancestors"]):
+            if uid not in upline:
                 break
-            
-            current_user = await db.users.find_one({"user_id": current_user_id}, {"_id": 0})
-            if not current_user or current_user.get("status") != "active":
-                # Skip to next level if user is inactive
-                current_user_id = current_user.get("sponsor_id") if current_user else None
-                continue
-            
-            rate = commission_rates[level]
-            amount = commission_base * rate
-            
-            commission = {
-                "commission_id": generate_id("comm_"),
-                "order_id": order["order_id"],
-                "user_id": current_user_id,
-                "level": level + 1,
-                "rate": rate * 100,
-                "base_amount": commission_base,
-                "amount": amount,
-                "status": "blocked",
-                "release_at": release_at,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.commissions.insert_one(commission)
-            
-            await db.users.update_one(
-                {"user_id": current_user_id},
-                {"$inc": {"blocked_balance": amount}}
-            )
-            commissions_created.append(commission)
-            
-            # Move up the chain
-            current_user_id = current_user.get("sponsor_id")
-    
-    # Update personal volume for buyer if they're a reseller
-    buyer = await db.users.find_one({"user_id": order["user_id"]}, {"_id": 0})
+            levels.append(upline[uid])
+        for level, member in enumerate(levels):
+            # Inactive members are skipped; their level's commission is not passed up
+            if member.get("status") == "active":
+                add_commission(member["user_id"], level + 1, commission_rates[level])
+    
+    new_commissions = []
+    if commissions_created:
+        # Upserted per (order, level), so a re-run never creates a level's commission twice
+        result = await db.commissions.bulk_write([
+            UpdateOne({"order_id": order["order_id"], "level": comm["level"]}, {"$setOnInsert": comm}, upsert=True)
+            for comm in commissions_created
+        ], ordered=False)
+        new_commissions = [commissions_created[idx] for idx in result.upserted_ids]
+    
+    # Every counter the order moves, summed per user so each user gets one $inc
+    increments = {}
+    def inc(user_id: str, field: str, amount: float):
+        fields = increments.setdefault(user_id, {})
+        fields[field] = fields.get(field, 0) + amount
+    
+    # Monthly sales bucket for the referrer (read by calculate_goal_progress)
+    inc(referrer_id, f"sales_by_month.{month_key(order['created_at'])}", order.get("total", 0))
+    
+    # Blocked balance from the stored commissions, including any a failed run already inserted
+    if commissions_created:
+        async for comm in db.commissions.find({"order_id": order["order_id"]}, {"_id": 0, "user_id": 1, "amount": 1, "created_at": 1}):
+            inc(comm["user_id"], "blocked_balance", comm["amount"])
+            inc(comm["user_id"], f"commissions_by_month.{month_key(comm['created_at'])}", comm["amount"])
+    
+    # Personal volume for the buyer if they're a reseller, and team volume for their whole
+    # upline, read straight off the buyer's ancestor path
+    buyer = await db.users.find_one({"user_id": order["user_id"]}, {"_id": 0, "access_level": 1, "ancestors": 1})
     if buyer and buyer.get("access_level") in [3, 4]:
-        await db.users.update_one(
-            {"user_id": order["user_id"]},
-            {"$inc": {"personal_volume": commission_base}}
+        inc(order["user_id"], "personal_volume", commission_base)
+        for ancestor_id in buyer.get("ancestors", []):
+            inc(ancestor_id, "team_volume", commission_base)
+    
+    # Guarded by the order id like credit_commission_batch's release batches, so a re-run
+    # skips the users a failed run already updated
+    await db.users.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "credit_batches": {"$ne": order["order_id"]}},
+            {
+                "$inc": fields,
+                "$push": {"credit_batches": {"$each": [order["order_id"]], "$slice": -CREDIT_BATCH_HISTORY}}
+            }
         )
-        
-        # Update team volume for upline
-        current_sponsor_id = buyer.get("sponsor_id")
-        while current_sponsor_id:
-            await db.users.update_one(
-                {"user_id": current_sponsor_id},
-                {"$inc": {"team_volume": commission_base}}
-            )
-            sponsor = await db.users.find_one({"user_id": current_sponsor_id}, {"_id": 0})
-            current_sponsor_id = sponsor.get("sponsor_id") if sponsor else None
+        for user_id, fields in increments.items()
+    ], ordered=False)
     
-    # Send push notifications for each commission created
-    for comm in commissions_created:
+    # Send push notifications for each commission created by this run
+    for comm in new_commissions:
         try:
             amount_str = f"R$ {comm['amount']:.2f}".replace('.', ',')
             level_str = f"{comm['level']}º nível" if comm['level'] > 0 else "indicação direta"
@@ -1457,45 +2341,54 @@ async def process_order_commissions(db, order, settings):
             )
             
             # Also send push notification
-            await send_push_notification(
+            run_in_background(send_push_notification(
                 db,
                 comm["user_id"],
                 "Nova Comissão Recebida! 💰",
                 f"Você recebeu {amount_str} de comissão ({level_str}). O valor será liberado em 7 dias.",
                 {"url": "/commissions", "type": "commission", "amount": comm["amount"]}
-            )
+            ))
         except Exception as e:
             logger.error(f"Error sending commission notification: {e}")
     
-    return commissions_created
+    return new_commissions
 
 async def reverse_order_commissions(db, order_id: str):
     """Reverse commissions for a cancelled order"""
     
-    commissions = await db.commissions.find({"order_id": order_id}).to_list(100)
+    commissions = await db.commissions.find(
+        {"order_id": order_id},
+        {"_id": 0, "user_id": 1, "amount": 1, "status": 1}
+    ).to_list(100)
     
+    # Net balance changes per user, applied in one bulk write
+    balance_changes = {}
     for comm in commissions:
         if comm.get("status") == "blocked":
-            await db.users.update_one(
-                {"user_id": comm["user_id"]},
-                {"$inc": {"blocked_balance": -comm["amount"]}}
-            )
+            field = "blocked_balance"
         elif comm.get("status") == "available":
-            await db.users.update_one(
-                {"user_id": comm["user_id"]},
-                {"$inc": {"available_balance": -comm["amount"]}}
-            )
-        
-        await db.commissions.update_one(
-            {"commission_id": comm["commission_id"]},
-            {"$set": {"status": "reversed", "reversed_at": datetime.now(timezone.utc).isoformat()}}
-        )
+            field = "available_balance"
+        else:
+            continue
+        changes = balance_changes.setdefault(comm["user_id"], {})
+        changes[field] = changes.get(field, 0) - comm["amount"]
+    
+    if balance_changes:
+        await db.users.bulk_write([
+            UpdateOne({"user_id": user_id}, {"$inc": changes})
+            for user_id, changes in balance_changes.items()
+        ], ordered=False)
+    
+    await db.commissions.update_many(
+        {"order_id": order_id},
+        {"$set": {"status": "reversed", "reversed_at": datetime.now(timezone.utc)}}
+    )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "commissions_reversed",
         "details": {"order_id": order_id, "commissions_count": len(commissions)},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
 
 # ==================== COMMISSIONS ====================
@@ -1506,6 +2399,8 @@ async def list_commissions(
     status: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
     user: dict = Depends(get_current_user)
 ):
     db = request.app.db
@@ -1514,49 +2409,46 @@ async def list_commissions(
     if status:
         query["status"] = status
     
-    total = await db.commissions.count_documents(query)
-    commissions = await db.commissions.find(query, {"_id": 0}).sort("created_at", -1).skip((page-1)*limit).limit(limit).to_list(limit)
+    total, (commissions, next_cursor) = await asyncio.gather(
+        count_for_page(db.commissions, query, include_total),
+        fetch_page(db.commissions, query, page, limit, cursor)
+    )
     
-    return {"commissions": commissions, "total": total, "page": page}
+    return {"commissions": commissions, "total": total, "page": page, "pages": page_count(total, limit), "has_more": next_cursor is not None, "next_cursor": next_cursor}
 
 @app.get("/api/commissions/summary")
 async def get_commission_summary(request: Request, user: dict = Depends(get_current_user)):
     db = request.app.db
     user_id = user["user_id"]
     
-    # Get totals by level
-    pipeline = [
-        {"$match": {"user_id": user_id}},
-        {"$group": {
-            "_id": "$level",
-            "total": {"$sum": "$amount"},
-            "count": {"$sum": 1}
-        }}
-    ]
-    
-    by_level = {}
-    async for doc in db.commissions.aggregate(pipeline):
-        by_level[doc["_id"]] = {"total": doc["total"], "count": doc["count"]}
-    
-    # Get totals by status
-    pipeline = [
-        {"$match": {"user_id": user_id}},
-        {"$group": {
-            "_id": "$status",
-            "total": {"$sum": "$amount"}
-        }}
-    ]
-    
-    by_status = {}
-    async for doc in db.commissions.aggregate(pipeline):
-        by_status[doc["_id"]] = doc["total"]
+    month_start = current_month_start()
+    level_docs, status_docs, this_month = await asyncio.gather(
+        # Totals by level
+        aggregate_list(db.commissions, [
+            {"$match": {"user_id": user_id}},
+            {"$group": {
+                "_id": "$level",
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1}
+            }}
+        ]),
+        # Totals by status
+        aggregate_list(db.commissions, [
+            {"$match": {"user_id": user_id}},
+            {"$group": {
+                "_id": "$status",
+                "total": {"$sum": "$amount"}
+            }}
+        ]),
+        # This month
+        aggregate_list(db.commissions, [
+            {"$match": {"user_id": user_id, "created_at": {"$gte": month_start}}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+        ], 1)
+    )
     
-    # This month
-    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0).isoformat()
-    this_month = await db.commissions.aggregate([
-        {"$match": {"user_id": user_id, "created_at": {"$gte": month_start}}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(1)
+    by_level = {doc["_id"]: {"total": doc["total"], "count": doc["count"]} for doc in level_docs}
+    by_status = {doc["_id"]: doc["total"] for doc in status_docs}
     
     return {
         "by_level": by_level,
@@ -1587,7 +2479,7 @@ async def get_wallet(request: Request, user: dict = Depends(get_current_user)):
 @app.post("/api/wallet/withdraw")
 async def request_withdrawal(request: Request, data: WithdrawalRequest, user: dict = Depends(get_current_user)):
     db = request.app.db
-    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
+    settings = await get_cached_settings(db)
     
     min_amount = settings.get("min_withdrawal_amount", 50)
     fee_percent = settings.get("withdrawal_fee_percent", 5)
@@ -1612,33 +2504,33 @@ async def request_withdrawal(request: Request, data: WithdrawalRequest, user: di
         "net_amount": net_amount,
         "status": "pending",
         "bank_info": user.get("bank_info"),
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "processed_at": None,
         "paid_at": None
     }
     
-    await db.withdrawals.insert_one(withdrawal)
-    
-    # Deduct from available balance
-    await db.users.update_one(
-        {"user_id": user["user_id"]},
-        {"$inc": {"available_balance": -data.amount}}
+    # Withdrawal, balance deduction and transaction record are independent writes
+    await asyncio.gather(
+        db.withdrawals.insert_one(withdrawal),
+        db.users.update_one(
+            {"user_id": user["user_id"]},
+            {"$inc": {"available_balance": -data.amount}}
+        ),
+        db.transactions.insert_one({
+            "transaction_id": generate_id("tx_"),
+            "user_id": user["user_id"],
+            "type": "withdrawal_request",
+            "amount": -data.amount,
+            "reference_id": withdrawal["withdrawal_id"],
+            "description": f"Solicitação de saque - R$ {data.amount:.2f}",
+            "created_at": datetime.now(timezone.utc)
+        })
     )
+    invalidate_dashboard_cache()
     
-    # Create transaction record
-    await db.transactions.insert_one({
-        "transaction_id": generate_id("tx_"),
-        "user_id": user["user_id"],
-        "type": "withdrawal_request",
-        "amount": -data.amount,
-        "reference_id": withdrawal["withdrawal_id"],
-        "description": f"Solicitação de saque - R$ {data.amount:.2f}",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    # Re-fetch withdrawal without _id
-    withdrawal_response = await db.withdrawals.find_one({"withdrawal_id": withdrawal["withdrawal_id"]}, {"_id": 0})
-    return withdrawal_response
+    # insert_one added an ObjectId _id to the dict
+    withdrawal.pop("_id", None)
+    return withdrawal
 
 @app.get("/api/wallet/withdrawals")
 async def list_withdrawals(
@@ -1646,6 +2538,8 @@ async def list_withdrawals(
     status: Optional[str] = None,
     page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
     user: dict = Depends(get_current_user)
 ):
     db = request.app.db
@@ -1658,10 +2552,19 @@ async def list_withdrawals(
     if status:
         query["status"] = status
     
-    total = await db.withdrawals.count_documents(query)
-    withdrawals = await db.withdrawals.find(query, {"_id": 0}).sort("created_at", -1).skip((page-1)*limit).limit(limit).to_list(limit)
+    total, (withdrawals, next_cursor) = await asyncio.gather(
+        count_for_page(db.withdrawals, query, include_total),
+        fetch_page(db.withdrawals, query, page, limit, cursor)
+    )
     
-    return {"withdrawals": withdrawals, "total": total, "page": page}
+    return {"withdrawals": withdrawals, "total": total, "page": page, "pages": page_count(total, limit), "has_more": next_cursor is not None, "next_cursor": next_cursor}
+
+# Allowed prior states for each withdrawal status an admin can set
+WITHDRAWAL_TRANSITIONS = {
+    "approved": ["pending"],
+    "paid": ["approved"],
+    "rejected": ["pending", "approved"],
+}
 
 @app.put("/api/wallet/withdrawals/{withdrawal_id}")
 async def update_withdrawal(
@@ -1672,45 +2575,110 @@ async def update_withdrawal(
 ):
     db = request.app.db
     
-    withdrawal = await db.withdrawals.find_one({"withdrawal_id": withdrawal_id}, {"_id": 0})
-    if not withdrawal:
-        raise HTTPException(status_code=404, detail="Withdrawal not found")
+    if status not in WITHDRAWAL_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid status")
     
     update_data = {"status": status}
     
     if status == "approved":
-        update_data["processed_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["processed_at"] = datetime.now(timezone.utc)
     elif status == "paid":
-        update_data["paid_at"] = datetime.now(timezone.utc).isoformat()
-    elif status == "rejected":
+        update_data["paid_at"] = datetime.now(timezone.utc)
+    
+    # Check-and-set on the allowed prior states, so a withdrawal is never refunded twice
+    # and a paid one can no longer be rejected
+    withdrawal = await db.withdrawals.find_one_and_update(
+        {"withdrawal_id": withdrawal_id, "status": {"$in": WITHDRAWAL_TRANSITIONS[status]}},
+        {"$set": update_data},
+        projection={"_id": 0, "user_id": 1, "amount": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not withdrawal:
+        current = await db.withdrawals.find_one({"withdrawal_id": withdrawal_id}, {"_id": 0, "status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Withdrawal not found")
+        raise HTTPException(status_code=409, detail=f"Cannot change a {current.get('status')} withdrawal to {status}")
+    
+    if status == "rejected":
         # Refund the amount
-        await db.users.update_one(
-            {"user_id": withdrawal["user_id"]},
-            {"$inc": {"available_balance": withdrawal["amount"]}}
+        await asyncio.gather(
+            db.users.update_one(
+                {"user_id": withdrawal["user_id"]},
+                {"$inc": {"available_balance": withdrawal["amount"]}}
+            ),
+            db.transactions.insert_one({
+                "transaction_id": generate_id("tx_"),
+                "user_id": withdrawal["user_id"],
+                "type": "withdrawal_refund",
+                "amount": withdrawal["amount"],
+                "reference_id": withdrawal_id,
+                "description": "Estorno de saque rejeitado",
+                "created_at": datetime.now(timezone.utc)
+            })
         )
-        
-        await db.transactions.insert_one({
-            "transaction_id": generate_id("tx_"),
-            "user_id": withdrawal["user_id"],
-            "type": "withdrawal_refund",
-            "amount": withdrawal["amount"],
-            "reference_id": withdrawal_id,
-            "description": "Estorno de saque rejeitado",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
     
-    await db.withdrawals.update_one({"withdrawal_id": withdrawal_id}, {"$set": update_data})
+    invalidate_dashboard_cache()
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "withdrawal_updated",
         "user_id": user["user_id"],
         "details": {"withdrawal_id": withdrawal_id, "new_status": status},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Withdrawal updated"}
 
+def withdrawals_report_pipeline(query: dict) -> list:
+    """Latest 1000 matching withdrawals joined with the user's contact and bank details;
+    withdrawals whose user no longer exists are left out"""
+    def field(path: str):
+        return {"$ifNull": [path, ""]}
+    
+    return [
+        {"$match": query},
+        {"$sort": {"created_at": -1}},
+        {"$limit": 1000},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "u",
+            "pipeline": [{"$project": {"_id": 0, "name": 1, "email": 1, "cpf": 1, "phone": 1, "bank_info": 1}}]
+        }},
+        {"$unwind": "$u"},
+        {"$project": {
+            "_id": 0,
+            "withdrawal_id": 1,
+            "user_id": 1,
+            "name": field("$u.name"),
+            "email": field("$u.email"),
+            "cpf": field("$u.cpf"),
+            "phone": field("$u.phone"),
+            "amount": 1,
+            "status": 1,
+            "created_at": 1,
+            "approved_at": {"$ifNull": ["$approved_at", None]},
+            "bank_name": field("$u.bank_info.bank_name"),
+            "bank_code": field("$u.bank_info.bank_code"),
+            "agency": field("$u.bank_info.agency"),
+            "account": field("$u.bank_info.account"),
+            "account_type": field("$u.bank_info.account_type"),
+            "pix_key": field("$u.bank_info.pix_key")
+        }}
+    ]
+
+WITHDRAWALS_EXPORT_HEADERS = (
+    "withdrawal_id", "user_id", "name", "email", "cpf", "phone",
+    "amount", "status", "created_at", "approved_at",
+    "bank_name", "bank_code", "agency", "account", "account_type", "pix_key"
+)
+WITHDRAWALS_EXPORT_LABELS = (
+    "ID Saque", "ID Usuário", "Nome", "Email", "CPF", "Telefone",
+    "Valor (R$)", "Status", "Data Solicitação", "Data Aprovação",
+    "Banco", "Código Banco", "Agência", "Conta", "Tipo Conta", "Chave PIX"
+)
+
 @app.get("/api/admin/withdrawals/report")
 async def get_withdrawals_report(
     request: Request,
@@ -1726,47 +2694,15 @@ async def get_withdrawals_report(
     query = {"status": status}
     
     if start_date:
-        query["created_at"] = {"$gte": start_date}
+        query["created_at"] = {"$gte": parse_date_param(start_date)}
     if end_date:
         if "created_at" not in query:
             query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date
-    
-    # Get withdrawals with user info
-    withdrawals = await db.withdrawals.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    
-    # Enrich with user data
-    report_data = []
-    total_amount = 0
+        query["created_at"]["$lte"] = parse_date_param(end_date)
     
-    for w in withdrawals:
-        user_data = await db.users.find_one(
-            {"user_id": w["user_id"]}, 
-            {"_id": 0, "name": 1, "email": 1, "cpf": 1, "phone": 1, "bank_info": 1}
-        )
-        
-        if user_data:
-            bank_info = user_data.get("bank_info", {}) or {}
-            report_item = {
-                "withdrawal_id": w["withdrawal_id"],
-                "user_id": w["user_id"],
-                "name": user_data.get("name", ""),
-                "email": user_data.get("email", ""),
-                "cpf": user_data.get("cpf", ""),
-                "phone": user_data.get("phone", ""),
-                "amount": w["amount"],
-                "status": w["status"],
-                "created_at": w["created_at"],
-                "approved_at": w.get("approved_at"),
-                "bank_name": bank_info.get("bank_name", ""),
-                "bank_code": bank_info.get("bank_code", ""),
-                "agency": bank_info.get("agency", ""),
-                "account": bank_info.get("account", ""),
-                "account_type": bank_info.get("account_type", ""),
-                "pix_key": bank_info.get("pix_key", ""),
-            }
-            report_data.append(report_item)
-            total_amount += w["amount"]
+    # Withdrawals joined with their user's contact and bank details in one aggregation
+    report_data = await aggregate_list(db.withdrawals, withdrawals_report_pipeline(query), 1000)
+    total_amount = sum(item["amount"] for item in report_data)
     
     return {
         "report": report_data,
@@ -1786,53 +2722,19 @@ async def export_withdrawals_report(
     """Export withdrawal report as CSV or JSON"""
     db = request.app.db
     
-    # Get report data
-    report_response = await get_withdrawals_report(request, status, None, None, user)
-    report_data = report_response["report"]
-    
     if format == "json":
-        return report_response
-    
-    # Generate CSV
-    import io
-    import csv
+        return await get_withdrawals_report(request, status, None, None, user)
     
-    output = io.StringIO()
-    writer = csv.writer(output)
+    # Stream CSV rows straight off the aggregation cursor
+    rows = await db.withdrawals.aggregate(withdrawals_report_pipeline({"status": status}), batchSize=EXPORT_CHUNK_SIZE)
     
-    # Header
-    writer.writerow([
-        "ID Saque", "ID Usuário", "Nome", "Email", "CPF", "Telefone",
-        "Valor (R$)", "Status", "Data Solicitação", "Data Aprovação",
-        "Banco", "Código Banco", "Agência", "Conta", "Tipo Conta", "Chave PIX"
-    ])
+    async def formatted():
+        async for row in rows:
+            row["amount"] = f"{row['amount']:.2f}"
+            yield row
     
-    # Data
-    for item in report_data:
-        writer.writerow([
-            item["withdrawal_id"],
-            item["user_id"],
-            item["name"],
-            item["email"],
-            item["cpf"],
-            item["phone"],
-            f"{item['amount']:.2f}",
-            item["status"],
-            item["created_at"],
-            item.get("approved_at", ""),
-            item["bank_name"],
-            item["bank_code"],
-            item["agency"],
-            item["account"],
-            item["account_type"],
-            item["pix_key"]
-        ])
-    
-    csv_content = output.getvalue()
-    output.close()
-    
-    return Response(
-        content=csv_content,
+    return StreamingResponse(
+        stream_csv_export(WITHDRAWALS_EXPORT_HEADERS, formatted(), labels=WITHDRAWALS_EXPORT_LABELS),
         media_type="text/csv",
         headers={
             "Content-Disposition": f"attachment; filename=saques_{status}_{datetime.now().strftime('%Y%m%d')}.csv"
@@ -1856,9 +2758,11 @@ async def get_supervised_users(
     request: Request,
     page: int = 1,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
     user: dict = Depends(get_current_user)
 ):
-    """Get users supervised by the current supervisor"""
+    """Get users supervised by the current supervisor, sorted by name"""
     db = request.app.db
     
     # Only supervisors can access this
@@ -1867,17 +2771,24 @@ async def get_supervised_users(
     
     query = {"supervisor_id": user["user_id"]}
     
-    total = await db.users.count_documents(query)
-    users = await db.users.find(
-        query,
-        {"_id": 0, "password": 0}
-    ).sort("name", 1).skip((page-1)*limit).limit(limit).to_list(limit)
+    # Keyset on (name, _id) when a cursor is given, so deep pages cost the same as the first
+    total, (users, next_cursor) = await asyncio.gather(
+        count_for_page(db.users, query, include_total),
+        fetch_page(
+            db.users, query, page, limit, cursor,
+            projection={"password": 0, "credit_batches": 0},
+            sort_field="name",
+            direction=1
+        )
+    )
     
     return {
         "users": users,
         "total": total,
         "page": page,
-        "pages": (total + limit - 1) // limit
+        "pages": page_count(total, limit),
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor
     }
 
 # ==================== SETTINGS (Admin Only) ====================
@@ -1885,7 +2796,7 @@ async def get_supervised_users(
 @app.get("/api/settings")
 async def get_settings(request: Request, user: dict = Depends(require_access_level(0))):
     db = request.app.db
-    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
+    settings = await get_cached_settings(db)
     return settings
 
 @app.put("/api/settings")
@@ -1897,20 +2808,27 @@ async def update_settings(request: Request, user: dict = Depends(require_access_
     body.pop("settings_id", None)
     body.pop("created_at", None)
     
-    body["updated_at"] = datetime.now(timezone.utc).isoformat()
+    body["updated_at"] = datetime.now(timezone.utc)
     body["updated_by"] = user["user_id"]
     
-    await db.settings.update_one({"settings_id": "global"}, {"$set": body})
+    updated = await db.settings.find_one_and_update(
+        {"settings_id": "global"},
+        {"$set": body},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    prime_settings_cache(updated)
+    invalidate_admin_dashboard_cache()
+    invalidate_dashboard_cache()
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "settings_updated",
         "user_id": user["user_id"],
         "details": body,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    updated = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
     return updated
 
 # ==================== REPORTS / DASHBOARD ====================
@@ -1919,39 +2837,59 @@ async def update_settings(request: Request, user: dict = Depends(require_access_
 async def admin_dashboard(request: Request, user: dict = Depends(require_access_level(1))):
     db = request.app.db
     
-    # User counts
-    user_counts = {}
-    for level, name in ACCESS_LEVELS.items():
-        user_counts[name] = await db.users.count_documents({"access_level": level})
-    
-    # Active/Inactive resellers
-    active_resellers = await db.users.count_documents({"access_level": 4, "status": "active"})
-    suspended_resellers = await db.users.count_documents({"access_level": 4, "status": "suspended"})
-    
-    # Orders summary
-    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0).isoformat()
-    
-    orders_this_month = await db.orders.aggregate([
-        {"$match": {"created_at": {"$gte": month_start}, "payment_status": "paid"}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
-    ]).to_list(1)
+    if _admin_dashboard_cache["value"] is not None and time.monotonic() - _admin_dashboard_cache["ts"] < ADMIN_DASHBOARD_CACHE_TTL:
+        return _admin_dashboard_cache["value"]
     
-    # Commissions summary
-    commissions_pending = await db.commissions.aggregate([
-        {"$match": {"status": "blocked"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(1)
-    
-    commissions_paid = await db.commissions.aggregate([
-        {"$match": {"status": "available"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(1)
-    
-    # Withdrawals pending
-    withdrawals_pending = await db.withdrawals.aggregate([
-        {"$match": {"status": "pending"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
-    ]).to_list(1)
+    # Single-flight: concurrent misses wait for one computation instead of each hitting Mongo
+    async with _admin_dashboard_lock:
+        if _admin_dashboard_cache["value"] is not None and time.monotonic() - _admin_dashboard_cache["ts"] < ADMIN_DASHBOARD_CACHE_TTL:
+            return _admin_dashboard_cache["value"]
+        
+        dashboard = await compute_admin_dashboard(db)
+        _admin_dashboard_cache["value"] = dashboard
+        _admin_dashboard_cache["ts"] = time.monotonic()
+        return dashboard
+
+async def compute_admin_dashboard(db) -> dict:
+    """Build the admin dashboard figures"""
+    month_start = current_month_start()
+    
+    # Every figure is an independent query, so run them all concurrently
+    (
+        level_counts,
+        active_resellers,
+        suspended_resellers,
+        orders_this_month,
+        commissions_pending,
+        commissions_paid,
+        withdrawals_pending
+    ) = await asyncio.gather(
+        # User counts
+        asyncio.gather(*(db.users.count_documents({"access_level": level}) for level in ACCESS_LEVELS)),
+        # Active/Inactive resellers
+        db.users.count_documents({"access_level": 4, "status": "active"}),
+        db.users.count_documents({"access_level": 4, "status": "suspended"}),
+        # Orders summary
+        aggregate_list(db.orders, [
+            {"$match": {"created_at": {"$gte": month_start}, "payment_status": "paid"}},
+            {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+        ], 1),
+        # Commissions summary
+        aggregate_list(db.commissions, [
+            {"$match": {"status": "blocked"}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+        ], 1),
+        aggregate_list(db.commissions, [
+            {"$match": {"status": "available"}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+        ], 1),
+        # Withdrawals pending
+        aggregate_list(db.withdrawals, [
+            {"$match": {"status": "pending"}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+        ], 1)
+    )
+    user_counts = dict(zip(ACCESS_LEVELS.values(), level_counts))
     
     return {
         "user_counts": user_counts,
@@ -1976,20 +2914,18 @@ async def reseller_dashboard(request: Request, user: dict = Depends(get_current_
     db = request.app.db
     user_id = user["user_id"]
     
-    # Network stats
-    network = await get_network_stats(request, user)
-    
-    # Commission summary
-    commission_summary = await get_commission_summary(request, user)
-    
-    # Recent orders from referral link
-    recent_referral_orders = await db.orders.find(
-        {"referrer_id": user_id, "payment_status": "paid"},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(5).to_list(5)
+    # Network stats, commission summary, recent referral orders and settings are independent
+    network, commission_summary, recent_referral_orders, settings = await asyncio.gather(
+        get_network_stats(request, user),
+        get_commission_summary(request, user),
+        db.orders.find(
+            {"referrer_id": user_id, "payment_status": "paid"},
+            {"_id": 0, "order_id": 1, "total": 1, "created_at": 1}
+        ).sort("created_at", -1).limit(5).to_list(5),
+        get_cached_settings(db)
+    )
     
     # Qualification status
-    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
     min_qualification = settings.get("min_qualification_amount", 100)
     personal_volume = user.get("personal_volume", 0)
     
@@ -1997,8 +2933,8 @@ async def reseller_dashboard(request: Request, user: dict = Depends(get_current_
     last_qual = user.get("last_qualification")
     months_inactive = 0
     if last_qual:
-        last_qual_date = datetime.fromisoformat(last_qual)
-        months_inactive = (datetime.now(timezone.utc) - last_qual_date).days // 30
+        inactive = relativedelta(datetime.now(timezone.utc), last_qual)
+        months_inactive = inactive.years * 12 + inactive.months
     
     return {
         "network": network,
@@ -2024,6 +2960,8 @@ async def list_logs(
     user_id: Optional[str] = None,
     page: int = 1,
     limit: int = 50,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
     user: dict = Depends(require_access_level(1))
 ):
     db = request.app.db
@@ -2034,10 +2972,12 @@ async def list_logs(
     if user_id:
         query["user_id"] = user_id
     
-    total = await db.logs.count_documents(query)
-    logs = await db.logs.find(query, {"_id": 0}).sort("created_at", -1).skip((page-1)*limit).limit(limit).to_list(limit)
+    total, (logs, next_cursor) = await asyncio.gather(
+        count_for_page(db.logs, query, include_total),
+        fetch_page(db.logs, query, page, limit, cursor)
+    )
     
-    return {"logs": logs, "total": total, "page": page}
+    return {"logs": logs, "total": total, "page": page, "pages": page_count(total, limit), "has_more": next_cursor is not None, "next_cursor": next_cursor}
 
 # ==================== SCHEDULED TASKS ====================
 
@@ -2046,52 +2986,28 @@ async def process_blocked_commissions(request: Request, user: dict = Depends(req
     """Release blocked commissions that have passed the 7-day period"""
     db = request.app.db
     
-    now = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
     
     # Find commissions to release
     commissions = await db.commissions.find({
         "status": "blocked",
         "release_at": {"$lte": now}
-    }).to_list(1000)
-    
-    released_count = 0
+    }, {"_id": 0, "commission_id": 1}).to_list(1000)
     
-    for comm in commissions:
-        # Move from blocked to available
-        await db.users.update_one(
-            {"user_id": comm["user_id"]},
-            {
-                "$inc": {
-                    "blocked_balance": -comm["amount"],
-                    "available_balance": comm["amount"]
-                }
-            }
-        )
-        
-        await db.commissions.update_one(
-            {"commission_id": comm["commission_id"]},
-            {"$set": {"status": "available", "released_at": now}}
-        )
-        
-        await db.transactions.insert_one({
-            "transaction_id": generate_id("tx_"),
-            "user_id": comm["user_id"],
-            "type": "commission_released",
-            "amount": comm["amount"],
-            "reference_id": comm["commission_id"],
-            "description": f"Comissão liberada - Nível {comm.get('level', 0)}",
-            "created_at": now
-        })
-        
-        released_count += 1
+    # Same check-and-set and idempotent credit as the scheduled job
+    released_count = await reconcile_released_commissions(db)
+    if commissions:
+        released_count += await release_commission_batch(db, [comm["commission_id"] for comm in commissions], now)
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "commissions_released",
         "user_id": user["user_id"],
         "details": {"count": released_count},
         "created_at": now
     })
+    invalidate_admin_dashboard_cache()
+    invalidate_dashboard_cache()
     
     return {"message": f"Released {released_count} commissions"}
 
@@ -2099,7 +3015,7 @@ async def process_blocked_commissions(request: Request, user: dict = Depends(req
 async def check_qualifications(request: Request, user: dict = Depends(require_access_level(0))):
     """Monthly check for reseller qualifications"""
     db = request.app.db
-    settings = await db.settings.find_one({"settings_id": "global"}, {"_id": 0})
+    settings = await get_cached_settings(db)
     
     min_qualification = settings.get("min_qualification_amount", 100)
     suspend_months = settings.get("inactive_months_suspend", 6)
@@ -2107,47 +3023,30 @@ async def check_qualifications(request: Request, user: dict = Depends(require_ac
     
     now = datetime.now(timezone.utc)
     
-    # Get all resellers
-    resellers = await db.users.find({"access_level": 4}, {"_id": 0}).to_list(10000)
+    # "Inactive for N months" is counted in calendar months: last_qualification <= now - N months
+    cancel_cutoff = now - relativedelta(months=cancel_months)
+    suspend_cutoff = now - relativedelta(months=suspend_months)
     
-    suspended_count = 0
-    cancelled_count = 0
+    # Cancel and restructure network - only the affected reseller ids are read.
+    # Cancellation and suspension select disjoint resellers, so they run concurrently
+    cancel_ids = await db.users.distinct(
+        "user_id",
+        {"access_level": 4, "status": {"$ne": "cancelled"}, "last_qualification": {"$lte": cancel_cutoff}}
+    )
+    cancelled_count = len(cancel_ids)
     
-    for reseller in resellers:
-        last_qual = reseller.get("last_qualification")
-        if not last_qual:
-            continue
-        
-        last_qual_date = datetime.fromisoformat(last_qual)
-        if last_qual_date.tzinfo is None:
-            last_qual_date = last_qual_date.replace(tzinfo=timezone.utc)
-        
-        months_inactive = (now - last_qual_date).days // 30
-        
-        if months_inactive >= cancel_months and reseller.get("status") != "cancelled":
-            # Cancel and restructure network
-            await db.users.update_one(
-                {"user_id": reseller["user_id"]},
-                {"$set": {"status": "cancelled"}}
-            )
-            
-            # Move downline up
-            await db.users.update_many(
-                {"sponsor_id": reseller["user_id"]},
-                {
-                    "$set": {"sponsor_id": reseller.get("sponsor_id")},
-                    "$inc": {"hierarchy_level": -1}
-                }
-            )
-            
-            cancelled_count += 1
-        
-        elif months_inactive >= suspend_months and reseller.get("status") == "active":
-            await db.users.update_one(
-                {"user_id": reseller["user_id"]},
-                {"$set": {"status": "suspended"}}
-            )
-            suspended_count += 1
+    _, suspended = await asyncio.gather(
+        cancel_resellers(db, cancel_ids),
+        db.users.update_many(
+            {
+                "access_level": 4,
+                "status": "active",
+                "last_qualification": {"$lte": suspend_cutoff, "$gt": cancel_cutoff}
+            },
+            {"$set": {"status": "suspended"}}
+        )
+    )
+    suspended_count = suspended.modified_count
     
     # Reset monthly volumes
     await db.users.update_many(
@@ -2155,18 +3054,34 @@ async def check_qualifications(request: Request, user: dict = Depends(require_ac
         {"$set": {"personal_volume": 0, "team_volume": 0}}
     )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "qualifications_checked",
         "user_id": user["user_id"],
         "details": {"suspended": suspended_count, "cancelled": cancelled_count},
-        "created_at": now.isoformat()
+        "created_at": now
     })
+    invalidate_admin_dashboard_cache()
+    invalidate_dashboard_cache()
     
     return {"message": f"Suspended: {suspended_count}, Cancelled: {cancelled_count}"}
 
 # ==================== RANKING & LEADERBOARD ====================
 
+# Joins the user fields onto ranking rows grouped by user_id ("_id")
+RANKING_USER_LOOKUP = [
+    {"$lookup": {
+        "from": "users",
+        "localField": "_id",
+        "foreignField": "user_id",
+        "as": "u",
+        "pipeline": [{"$project": {"_id": 0, "user_id": 1, "name": 1, "email": 1, "access_level": 1, "picture": 1}}]
+    }},
+    {"$unwind": "$u"},
+    {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$u", "$$ROOT"]}}},
+    {"$project": {"u": 0, "_id": 0}}
+]
+
 @app.get("/api/ranking/resellers")
 async def get_reseller_ranking(
     request: Request,
@@ -2181,14 +3096,14 @@ async def get_reseller_ranking(
     # Calculate date range
     now = datetime.now(timezone.utc)
     if period == "week":
-        start_date = (now - timedelta(days=7)).isoformat()
+        start_date = now - timedelta(days=7)
     elif period == "month":
-        start_date = now.replace(day=1, hour=0, minute=0, second=0).isoformat()
+        start_date = current_month_start()
     elif period == "quarter":
         quarter_month = ((now.month - 1) // 3) * 3 + 1
-        start_date = now.replace(month=quarter_month, day=1, hour=0, minute=0, second=0).isoformat()
+        start_date = now.replace(month=quarter_month, day=1, hour=0, minute=0, second=0)
     elif period == "year":
-        start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0).isoformat()
+        start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0)
     else:
         start_date = None
     
@@ -2206,9 +3121,10 @@ async def get_reseller_ranking(
                 "order_count": {"$sum": 1}
             }},
             {"$sort": {"total_sales": -1}},
-            {"$limit": limit}
+            {"$limit": limit},
+            *RANKING_USER_LOOKUP
         ]
-        results = await db.orders.aggregate(pipeline).to_list(limit)
+        results = await aggregate_list(db.orders, pipeline, limit)
         
     elif metric == "commissions":
         # Ranking by commissions earned
@@ -2224,26 +3140,23 @@ async def get_reseller_ranking(
                 "commission_count": {"$sum": 1}
             }},
             {"$sort": {"total_commissions": -1}},
-            {"$limit": limit}
+            {"$limit": limit},
+            *RANKING_USER_LOOKUP
         ]
-        results = await db.commissions.aggregate(pipeline).to_list(limit)
+        results = await aggregate_list(db.commissions, pipeline, limit)
         
     elif metric == "network":
-        # Ranking by network size
+        # Ranking by network size (direct_referrals_count is maintained on the user doc)
         pipeline = [
             {"$match": {"access_level": {"$in": [3, 4]}, "status": "active"}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "sponsor_id",
-                "as": "direct_referrals"
-            }},
-            {"$addFields": {"network_size": {"$size": "$direct_referrals"}}},
-            {"$sort": {"network_size": -1}},
+            {"$sort": {"direct_referrals_count": -1}},
             {"$limit": limit},
-            {"$project": {"_id": 0, "user_id": 1, "name": 1, "network_size": 1, "access_level": 1}}
+            {"$project": {
+                "_id": 0, "user_id": 1, "name": 1, "access_level": 1,
+                "network_size": {"$ifNull": ["$direct_referrals_count", 0]}
+            }}
         ]
-        results = await db.users.aggregate(pipeline).to_list(limit)
+        results = await aggregate_list(db.users, pipeline, limit)
         
         return {"ranking": results, "period": period, "metric": metric}
     
@@ -2256,19 +3169,8 @@ async def get_reseller_ranking(
         
         return {"ranking": results, "period": period, "metric": metric}
     
-    # Enrich with user data for sales/commissions
-    enriched = []
-    for idx, item in enumerate(results):
-        user_data = await db.users.find_one(
-            {"user_id": item["_id"]},
-            {"_id": 0, "user_id": 1, "name": 1, "email": 1, "access_level": 1, "picture": 1}
-        )
-        if user_data:
-            enriched.append({
-                "rank": idx + 1,
-                **user_data,
-                **{k: v for k, v in item.items() if k != "_id"}
-            })
+    # User data for sales/commissions is joined in the pipeline
+    enriched = [{"rank": idx + 1, **item} for idx, item in enumerate(results)]
     
     return {"ranking": enriched, "period": period, "metric": metric}
 
@@ -2294,22 +3196,25 @@ async def create_goal(request: Request, data: GoalCreate, user: dict = Depends(r
     goal = {
         "goal_id": generate_id("goal_"),
         **data.model_dump(),
+        "start_date": parse_date_param(data.start_date),
+        "end_date": parse_date_param(data.end_date),
         "created_by": user["user_id"],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.goals.insert_one(goal)
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "goal_created",
         "user_id": user["user_id"],
         "details": {"goal_id": goal["goal_id"], "name": data.name},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    goal_response = await db.goals.find_one({"goal_id": goal["goal_id"]}, {"_id": 0})
-    return goal_response
+    # insert_one added an ObjectId _id to the dict
+    goal.pop("_id", None)
+    return goal
 
 @app.get("/api/goals")
 async def list_goals(
@@ -2322,7 +3227,7 @@ async def list_goals(
     
     query = {"access_levels": user.get("access_level")}
     if active_only:
-        now = datetime.now(timezone.utc).isoformat()
+        now = datetime.now(timezone.utc)
         query["active"] = True
         query["end_date"] = {"$gte": now}
     
@@ -2353,17 +3258,20 @@ async def update_goal(request: Request, goal_id: str, data: GoalCreate, user: di
     """Update a goal"""
     db = request.app.db
     
-    existing = await db.goals.find_one({"goal_id": goal_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Goal not found")
-    
     update_data = data.model_dump()
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["start_date"] = parse_date_param(data.start_date)
+    update_data["end_date"] = parse_date_param(data.end_date)
+    update_data["updated_at"] = datetime.now(timezone.utc)
     update_data["updated_by"] = user["user_id"]
     
-    await db.goals.update_one({"goal_id": goal_id}, {"$set": update_data})
-    
-    updated = await db.goals.find_one({"goal_id": goal_id}, {"_id": 0})
+    updated = await db.goals.find_one_and_update(
+        {"goal_id": goal_id},
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Goal not found")
     return updated
 
 @app.delete("/api/goals/{goal_id}")
@@ -2386,25 +3294,34 @@ async def calculate_goal_progress(db, user_id: str, goal: dict) -> dict:
     
     current_value = 0
     
-    if metric == "sales":
-        result = await db.orders.aggregate([
+    # Whole-month ranges are answered from the per-month counters on the user doc
+    months = full_month_keys(start_date, end_date) if metric in ("sales", "commissions") else None
+    
+    if months is not None:
+        field = "sales_by_month" if metric == "sales" else "commissions_by_month"
+        user_data = await db.users.find_one({"user_id": user_id}, {"_id": 0, field: 1})
+        buckets = (user_data or {}).get(field) or {}
+        current_value = sum(buckets.get(m, 0) for m in months)
+        
+    elif metric == "sales":
+        result = await aggregate_list(db.orders, [
             {"$match": {
                 "referrer_id": user_id,
                 "payment_status": "paid",
                 "created_at": {"$gte": start_date, "$lte": end_date}
             }},
             {"$group": {"_id": None, "total": {"$sum": "$total"}}}
-        ]).to_list(1)
+        ], 1)
         current_value = result[0]["total"] if result else 0
         
     elif metric == "commissions":
-        result = await db.commissions.aggregate([
+        result = await aggregate_list(db.commissions, [
             {"$match": {
                 "user_id": user_id,
                 "created_at": {"$gte": start_date, "$lte": end_date}
             }},
             {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]).to_list(1)
+        ], 1)
         current_value = result[0]["total"] if result else 0
         
     elif metric == "network":
@@ -2418,6 +3335,10 @@ async def calculate_goal_progress(db, user_id: str, goal: dict) -> dict:
         user_data = await db.users.find_one({"user_id": user_id}, {"_id": 0})
         current_value = user_data.get("personal_volume", 0) if user_data else 0
     
+    return build_goal_progress(current_value, target)
+
+def build_goal_progress(current_value: float, target: float) -> dict:
+    """Shape a progress dict from a current value and a target"""
     percentage = min((current_value / target * 100) if target > 0 else 0, 100)
     completed = current_value >= target
     
@@ -2429,6 +3350,50 @@ async def calculate_goal_progress(db, user_id: str, goal: dict) -> dict:
         "remaining": max(target - current_value, 0)
     }
 
+async def calculate_goals_progress_values(db, users: List[dict], goal: dict) -> dict:
+    """Current value of a goal's metric for many users at once, keyed by user_id.
+    Runs one grouped aggregation per goal instead of one query per user."""
+    metric = goal.get("metric")
+    start_date = goal.get("start_date")
+    end_date = goal.get("end_date")
+    user_ids = [u["user_id"] for u in users]
+    
+    if metric == "personal_volume":
+        return {u["user_id"]: u.get("personal_volume", 0) for u in users}
+    
+    # Whole-month ranges are answered from the per-month counters, reading only those months
+    months = full_month_keys(start_date, end_date) if metric in ("sales", "commissions") else None
+    if months is not None:
+        field = "sales_by_month" if metric == "sales" else "commissions_by_month"
+        projection = {"_id": 0, "user_id": 1, **{f"{field}.{m}": 1 for m in months}}
+        values = {}
+        async for doc in db.users.find({"user_id": {"$in": user_ids}}, projection).batch_size(1000):
+            buckets = doc.get(field) or {}
+            values[doc["user_id"]] = sum(buckets.get(m, 0) for m in months)
+        return values
+    
+    if metric == "sales":
+        collection, group_field, value = db.orders, "$referrer_id", {"$sum": "$total"}
+        match = {"referrer_id": {"$in": user_ids}, "payment_status": "paid"}
+    elif metric == "commissions":
+        collection, group_field, value = db.commissions, "$user_id", {"$sum": "$amount"}
+        match = {"user_id": {"$in": user_ids}}
+    elif metric == "network":
+        collection, group_field, value = db.users, "$sponsor_id", {"$sum": 1}
+        match = {"sponsor_id": {"$in": user_ids}, "access_level": {"$in": [3, 4]}}
+    else:
+        return {}
+    
+    match["created_at"] = {"$gte": start_date, "$lte": end_date}
+    
+    values = {}
+    async for doc in await collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": group_field, "total": value}}
+    ]):
+        values[doc["_id"]] = doc["total"]
+    return values
+
 @app.get("/api/goals/achievements/{user_id}")
 async def get_user_achievements(request: Request, user_id: str, user: dict = Depends(get_current_user)):
     """Get all achievements/completed goals for a user"""
@@ -2451,12 +3416,11 @@ async def process_goal_achievements(request: Request, user: dict = Depends(requi
     db = request.app.db
     
     now = datetime.now(timezone.utc)
-    now_str = now.isoformat()
     
     # Get active goals that ended
     ended_goals = await db.goals.find({
         "active": True,
-        "end_date": {"$lte": now_str}
+        "end_date": {"$lte": now}
     }, {"_id": 0}).to_list(100)
     
     achievements_created = 0
@@ -2464,75 +3428,97 @@ async def process_goal_achievements(request: Request, user: dict = Depends(requi
     
     for goal in ended_goals:
         # Get all eligible users
-        eligible_users = await db.users.find({
+        eligible_users = [u async for u in db.users.find({
             "access_level": {"$in": goal.get("access_levels", [3, 4])},
             "status": "active"
-        }, {"_id": 0}).to_list(10000)
+        }, {"_id": 0, "user_id": 1, "personal_volume": 1}).batch_size(1000)]
+        
+        # Skip users already processed for this goal
+        already_achieved = {
+            a["user_id"] async for a in db.achievements.find(
+                {"goal_id": goal["goal_id"], "user_id": {"$in": [u["user_id"] for u in eligible_users]}},
+                {"_id": 0, "user_id": 1}
+            )
+        }
+        
+        # Calculate progress for every eligible user in one aggregation
+        values = await calculate_goals_progress_values(db, eligible_users, goal)
+        
+        achievement_docs = []
+        bonuses = []
         
         for eligible_user in eligible_users:
-            # Check if already processed
-            existing = await db.achievements.find_one({
-                "goal_id": goal["goal_id"],
-                "user_id": eligible_user["user_id"]
-            })
-            
-            if existing:
+            if eligible_user["user_id"] in already_achieved:
                 continue
             
-            # Calculate progress
-            progress = await calculate_goal_progress(db, eligible_user["user_id"], goal)
+            progress = build_goal_progress(values.get(eligible_user["user_id"], 0), goal.get("target_value", 0))
             
             if progress["completed"]:
-                # Create achievement
-                achievement = {
+                achievement_docs.append({
                     "achievement_id": generate_id("ach_"),
                     "goal_id": goal["goal_id"],
                     "goal_name": goal["name"],
                     "user_id": eligible_user["user_id"],
                     "final_value": progress["current_value"],
                     "target_value": progress["target_value"],
-                    "achieved_at": now_str
-                }
-                await db.achievements.insert_one(achievement)
-                achievements_created += 1
+                    "achieved_at": now
+                })
                 
                 # Award bonus
                 bonus_amount = goal.get("bonus_amount", 0)
                 if goal.get("bonus_type") == "percentage":
                     bonus_amount = progress["current_value"] * (bonus_amount / 100)
-                
-                if bonus_amount > 0:
-                    await db.users.update_one(
-                        {"user_id": eligible_user["user_id"]},
-                        {
-                            "$inc": {"available_balance": bonus_amount, "points": int(bonus_amount)},
-                        }
-                    )
-                    
-                    await db.transactions.insert_one({
-                        "transaction_id": generate_id("tx_"),
-                        "user_id": eligible_user["user_id"],
-                        "type": "goal_bonus",
-                        "amount": bonus_amount,
-                        "reference_id": goal["goal_id"],
-                        "description": f"Bônus por meta: {goal['name']}",
-                        "created_at": now_str
-                    })
-                    bonuses_awarded += 1
+                bonuses.append(bonus_amount)
+        
+        # Upsert on (user_id, goal_id) so a concurrent or earlier run's achievement is kept, and
+        # only pay bonuses for the achievements this run actually inserted
+        inserted = {}
+        if achievement_docs:
+            result = await db.achievements.bulk_write([
+                UpdateOne({"user_id": doc["user_id"], "goal_id": doc["goal_id"]}, {"$setOnInsert": doc}, upsert=True)
+                for doc in achievement_docs
+            ], ordered=False)
+            inserted = result.upserted_ids
+            achievements_created += len(inserted)
+        
+        bonus_ops = []
+        transaction_docs = []
+        for idx in inserted:
+            user_id, bonus_amount = achievement_docs[idx]["user_id"], bonuses[idx]
+            if bonus_amount > 0:
+                bonus_ops.append(UpdateOne(
+                    {"user_id": user_id},
+                    {"$inc": {"available_balance": bonus_amount, "points": int(bonus_amount)}}
+                ))
+                transaction_docs.append({
+                    "transaction_id": generate_id("tx_"),
+                    "user_id": user_id,
+                    "type": "goal_bonus",
+                    "amount": bonus_amount,
+                    "reference_id": goal["goal_id"],
+                    "description": f"Bônus por meta: {goal['name']}",
+                    "created_at": now
+                })
+        if bonus_ops:
+            await db.users.bulk_write(bonus_ops, ordered=False)
+            await db.transactions.insert_many(transaction_docs, ordered=False)
+            bonuses_awarded += len(bonus_ops)
         
         # Mark goal as processed
         await db.goals.update_one(
             {"goal_id": goal["goal_id"]},
-            {"$set": {"processed": True, "processed_at": now_str}}
+            {"$set": {"processed": True, "processed_at": now}}
         )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "goals_processed",
         "user_id": user["user_id"],
         "details": {"achievements": achievements_created, "bonuses": bonuses_awarded},
-        "created_at": now_str
+        "created_at": now
     })
+    invalidate_admin_dashboard_cache()
+    invalidate_dashboard_cache()
     
     return {"achievements_created": achievements_created, "bonuses_awarded": bonuses_awarded}
 
@@ -2549,7 +3535,7 @@ async def get_referral_link(request: Request, user: dict = Depends(get_current_u
     # Get referral stats
     total_clicks = await db.referral_clicks.count_documents({"referral_code": referral_code})
     
-    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0).isoformat()
+    month_start = current_month_start()
     monthly_clicks = await db.referral_clicks.count_documents({
         "referral_code": referral_code,
         "created_at": {"$gte": month_start}
@@ -2592,7 +3578,7 @@ async def track_referral_click(request: Request):
         raise HTTPException(status_code=400, detail="Referral code required")
     
     # Verify code exists
-    referrer = await db.users.find_one({"referral_code": referral_code})
+    referrer = await db.users.find_one({"referral_code": referral_code}, {"_id": 0, "user_id": 1})
     if not referrer:
         raise HTTPException(status_code=404, detail="Invalid referral code")
     
@@ -2603,7 +3589,7 @@ async def track_referral_click(request: Request):
         "referrer_id": referrer["user_id"],
         "ip_address": request.client.host if request.client else None,
         "user_agent": request.headers.get("user-agent"),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.referral_clicks.insert_one(click)
@@ -2629,6 +3615,19 @@ async def get_referral_clicks(
 
 # ==================== EXPORT REPORTS ====================
 
+SALES_EXPORT_HEADERS = ("order_id", "created_at", "user_id", "subtotal", "shipping", "total", "payment_status", "order_status", "referrer_id")
+SALES_EXPORT_PROJECTION = {"_id": 0, **{h: 1 for h in SALES_EXPORT_HEADERS}}
+
+COMMISSIONS_EXPORT_HEADERS = ("commission_id", "created_at", "user_id", "user_name", "user_email", "order_id", "level", "rate", "base_amount", "amount", "status")
+# user_name/user_email are joined from users
+COMMISSIONS_EXPORT_PROJECTION = {"_id": 0, **{h: 1 for h in COMMISSIONS_EXPORT_HEADERS if h not in ("user_name", "user_email")}}
+
+USERS_EXPORT_HEADERS = ("user_id", "name", "email", "phone", "access_level", "status", "referral_code", "sponsor_id", "created_at", "personal_volume", "team_volume", "available_balance", "blocked_balance", "points")
+USERS_EXPORT_PROJECTION = {"_id": 0, **{h: 1 for h in USERS_EXPORT_HEADERS}}
+
+NETWORK_EXPORT_HEADERS = ("network_level", "user_id", "name", "email", "access_level", "status", "personal_volume", "team_volume", "created_at")
+NETWORK_EXPORT_PROJECTION = {"_id": 0, **{h: 1 for h in NETWORK_EXPORT_HEADERS}}
+
 @app.get("/api/export/sales")
 async def export_sales_report(
     request: Request,
@@ -2642,30 +3641,17 @@ async def export_sales_report(
     
     query = {"payment_status": "paid"}
     if start_date:
-        query["created_at"] = {"$gte": start_date}
+        query["created_at"] = {"$gte": parse_date_param(start_date)}
     if end_date:
-        query.setdefault("created_at", {})["$lte"] = end_date
+        query.setdefault("created_at", {})["$lte"] = parse_date_param(end_date)
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(10000)
+    orders = db.orders.find(query, SALES_EXPORT_PROJECTION).sort("created_at", -1).batch_size(EXPORT_CHUNK_SIZE)
     
     if format == "json":
-        return {"orders": orders, "total_count": len(orders)}
+        return StreamingResponse(stream_json_export("orders", orders), media_type="application/json")
     
-    # CSV format
-    import io
-    output = io.StringIO()
-    
-    headers = ["order_id", "created_at", "user_id", "subtotal", "shipping", "total", "payment_status", "order_status", "referrer_id"]
-    output.write(",".join(headers) + "\n")
-    
-    for order in orders:
-        row = [str(order.get(h, "")) for h in headers]
-        output.write(",".join(row) + "\n")
-    
-    csv_content = output.getvalue()
-    
-    return Response(
-        content=csv_content,
+    return StreamingResponse(
+        stream_csv_export(SALES_EXPORT_HEADERS, orders),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=sales_report_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
@@ -2683,36 +3669,34 @@ async def export_commissions_report(
     
     query = {}
     if start_date:
-        query["created_at"] = {"$gte": start_date}
+        query["created_at"] = {"$gte": parse_date_param(start_date)}
     if end_date:
-        query.setdefault("created_at", {})["$lte"] = end_date
+        query.setdefault("created_at", {})["$lte"] = parse_date_param(end_date)
     
-    commissions = await db.commissions.find(query, {"_id": 0}).sort("created_at", -1).to_list(10000)
-    
-    # Enrich with user names
-    for comm in commissions:
-        user_data = await db.users.find_one({"user_id": comm["user_id"]}, {"name": 1, "email": 1})
-        if user_data:
-            comm["user_name"] = user_data.get("name")
-            comm["user_email"] = user_data.get("email")
+    # User name and email are joined in the pipeline instead of looked up per row
+    commissions = await db.commissions.aggregate([
+        {"$match": query},
+        {"$sort": {"created_at": -1}},
+        {"$project": COMMISSIONS_EXPORT_PROJECTION},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "u",
+            "pipeline": [{"$project": {"_id": 0, "name": 1, "email": 1}}]
+        }},
+        {"$set": {
+            "user_name": {"$arrayElemAt": ["$u.name", 0]},
+            "user_email": {"$arrayElemAt": ["$u.email", 0]}
+        }},
+        {"$unset": "u"}
+    ], batchSize=EXPORT_CHUNK_SIZE, allowDiskUse=True)
     
     if format == "json":
-        return {"commissions": commissions, "total_count": len(commissions)}
+        return StreamingResponse(stream_json_export("commissions", commissions), media_type="application/json")
     
-    import io
-    output = io.StringIO()
-    
-    headers = ["commission_id", "created_at", "user_id", "user_name", "user_email", "order_id", "level", "rate", "base_amount", "amount", "status"]
-    output.write(",".join(headers) + "\n")
-    
-    for comm in commissions:
-        row = [str(comm.get(h, "")) for h in headers]
-        output.write(",".join(row) + "\n")
-    
-    csv_content = output.getvalue()
-    
-    return Response(
-        content=csv_content,
+    return StreamingResponse(
+        stream_csv_export(COMMISSIONS_EXPORT_HEADERS, commissions),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=commissions_report_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
@@ -2734,25 +3718,13 @@ async def export_users_report(
     if status:
         query["status"] = status
     
-    users = await db.users.find(query, {"_id": 0, "password": 0}).to_list(10000)
+    users = db.users.find(query, USERS_EXPORT_PROJECTION).batch_size(EXPORT_CHUNK_SIZE)
     
     if format == "json":
-        return {"users": users, "total_count": len(users)}
-    
-    import io
-    output = io.StringIO()
+        return StreamingResponse(stream_json_export("users", users), media_type="application/json")
     
-    headers = ["user_id", "name", "email", "phone", "access_level", "status", "referral_code", "sponsor_id", "created_at", "personal_volume", "team_volume", "available_balance", "blocked_balance", "points"]
-    output.write(",".join(headers) + "\n")
-    
-    for u in users:
-        row = [str(u.get(h, "")) for h in headers]
-        output.write(",".join(row) + "\n")
-    
-    csv_content = output.getvalue()
-    
-    return Response(
-        content=csv_content,
+    return StreamingResponse(
+        stream_csv_export(USERS_EXPORT_HEADERS, users),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=users_report_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
@@ -2771,103 +3743,107 @@ async def export_network_report(
     if user["user_id"] != user_id and user.get("access_level") > 2:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Get all downline (3 levels)
-    async def get_downline(sponsor_id: str, level: int = 1, max_level: int = 3):
-        if level > max_level:
-            return []
-        
-        direct = await db.users.find(
-            {"sponsor_id": sponsor_id, "access_level": {"$in": [3, 4]}},
-            {"_id": 0, "password": 0}
-        ).to_list(1000)
-        
-        result = []
-        for d in direct:
-            d["network_level"] = level
-            result.append(d)
-            result.extend(await get_downline(d["user_id"], level + 1, max_level))
-        
-        return result
-    
-    network = await get_downline(user_id)
+    # Get all downline (3 levels) in one server-side traversal
+    network = await db.users.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$graphLookup": {
+            "from": "users",
+            "startWith": "$user_id",
+            "connectFromField": "user_id",
+            "connectToField": "sponsor_id",
+            "as": "network",
+            "maxDepth": 2,
+            "depthField": "network_level",
+            "restrictSearchWithMatch": {"access_level": {"$in": [3, 4]}}
+        }},
+        {"$unwind": "$network"},
+        {"$replaceRoot": {"newRoot": "$network"}},
+        {"$set": {"network_level": {"$add": ["$network_level", 1]}}},
+        {"$project": NETWORK_EXPORT_PROJECTION},
+        {"$sort": {"network_level": 1, "created_at": 1}}
+    ], batchSize=EXPORT_CHUNK_SIZE)
     
     if format == "json":
-        return {"network": network, "total_count": len(network)}
+        return StreamingResponse(stream_json_export("network", network), media_type="application/json")
     
-    import io
-    output = io.StringIO()
-    
-    headers = ["network_level", "user_id", "name", "email", "access_level", "status", "personal_volume", "team_volume", "created_at"]
-    output.write(",".join(headers) + "\n")
-    
-    for n in network:
-        row = [str(n.get(h, "")) for h in headers]
-        output.write(",".join(row) + "\n")
-    
-    csv_content = output.getvalue()
-    
-    return Response(
-        content=csv_content,
+    return StreamingResponse(
+        stream_csv_export(NETWORK_EXPORT_HEADERS, network),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=network_report_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
 
 # ==================== DASHBOARD PER ACCESS LEVEL ====================
 
+# Order fields shown in the dashboards' recent order lists
+RECENT_ORDER_PROJECTION = {
+    "_id": 0, "order_id": 1, "user_id": 1, "referrer_id": 1, "total": 1,
+    "payment_status": 1, "order_status": 1, "created_at": 1
+}
+
 @app.get("/api/dashboard/supervisor")
 async def supervisor_dashboard(request: Request, user: dict = Depends(require_access_level(2))):
     """Dashboard for Supervisor (Level 2)"""
-    db = request.app.db
-    
+    return await cached_dashboard("supervisor", user["user_id"], lambda: build_supervisor_dashboard(request.app.db, user))
+
+async def build_supervisor_dashboard(db, user: dict) -> dict:
     # Get assigned resellers or all if none assigned
     assigned_ids = user.get("assigned_resellers", [])
     reseller_query = {"access_level": 4}
     if assigned_ids:
         reseller_query["user_id"] = {"$in": assigned_ids}
     
-    # Reseller stats
-    total_resellers = await db.users.count_documents(reseller_query)
-    active_resellers = await db.users.count_documents({**reseller_query, "status": "active"})
-    suspended_resellers = await db.users.count_documents({**reseller_query, "status": "suspended"})
-    
     # This month orders from resellers
-    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0).isoformat()
+    month_start = current_month_start()
     
     if assigned_ids:
         orders_query = {"referrer_id": {"$in": assigned_ids}, "created_at": {"$gte": month_start}, "payment_status": "paid"}
+        referred_orders_query = orders_query
     else:
         orders_query = {"created_at": {"$gte": month_start}, "payment_status": "paid"}
+        referred_orders_query = dict(orders_query, referrer_id={"$ne": None})
+    
+    # All dashboard queries are independent, so run them concurrently
+    status_counts, orders_this_month, top_resellers, recent_orders = await asyncio.gather(
+        # Reseller stats, one bucket per status
+        aggregate_list(db.users, [
+            {"$match": reseller_query},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]),
+        aggregate_list(db.orders, [
+            {"$match": orders_query},
+            {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+        ], 1),
+        # Top performing resellers
+        aggregate_list(db.orders, [
+            {"$match": referred_orders_query},
+            {"$group": {"_id": "$referrer_id", "total_sales": {"$sum": "$total"}}},
+            {"$sort": {"total_sales": -1}},
+            {"$limit": 5},
+            {"$lookup": {
+                "from": "users",
+                "localField": "_id",
+                "foreignField": "user_id",
+                "as": "u",
+                "pipeline": [{"$project": {"_id": 0, "name": 1, "email": 1}}]
+            }},
+            {"$unwind": {"path": "$u", "preserveNullAndEmptyArrays": True}},
+            {"$addFields": {"name": "$u.name", "email": "$u.email"}},
+            {"$project": {"u": 0}}
+        ], 5),
+        # Recent activity
+        db.orders.find(
+            orders_query,
+            RECENT_ORDER_PROJECTION
+        ).sort("created_at", -1).limit(5).to_list(5)
+    )
     
-    orders_this_month = await db.orders.aggregate([
-        {"$match": orders_query},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
-    ]).to_list(1)
-    
-    # Top performing resellers
-    top_resellers = await db.orders.aggregate([
-        {"$match": {**orders_query, "referrer_id": {"$ne": None}}},
-        {"$group": {"_id": "$referrer_id", "total_sales": {"$sum": "$total"}}},
-        {"$sort": {"total_sales": -1}},
-        {"$limit": 5}
-    ]).to_list(5)
-    
-    for tr in top_resellers:
-        user_data = await db.users.find_one({"user_id": tr["_id"]}, {"_id": 0, "name": 1, "email": 1})
-        if user_data:
-            tr["name"] = user_data.get("name")
-            tr["email"] = user_data.get("email")
-    
-    # Recent activity
-    recent_orders = await db.orders.find(
-        orders_query,
-        {"_id": 0}
-    ).sort("created_at", -1).limit(5).to_list(5)
+    resellers_by_status = {s["_id"]: s["count"] for s in status_counts}
     
     return {
         "resellers": {
-            "total": total_resellers,
-            "active": active_resellers,
-            "suspended": suspended_resellers
+            "total": sum(resellers_by_status.values()),
+            "active": resellers_by_status.get("active", 0),
+            "suspended": resellers_by_status.get("suspended", 0)
         },
         "orders_this_month": {
             "total": orders_this_month[0]["total"] if orders_this_month else 0,
@@ -2880,51 +3856,75 @@ async def supervisor_dashboard(request: Request, user: dict = Depends(require_ac
 @app.get("/api/dashboard/leader")
 async def leader_dashboard(request: Request, user: dict = Depends(get_current_user)):
     """Dashboard for Team Leader (Level 3)"""
-    db = request.app.db
-    user_id = user["user_id"]
-    
     if user.get("access_level") > 3:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Team stats (direct + indirect)
-    direct_count = await db.users.count_documents({"sponsor_id": user_id, "access_level": {"$in": [3, 4]}})
-    
-    # Get indirect (level 2 and 3)
-    direct_ids = [u["user_id"] for u in await db.users.find({"sponsor_id": user_id}, {"user_id": 1}).to_list(100)]
-    level_2_count = await db.users.count_documents({"sponsor_id": {"$in": direct_ids}, "access_level": {"$in": [3, 4]}}) if direct_ids else 0
-    
-    level_2_ids = [u["user_id"] for u in await db.users.find({"sponsor_id": {"$in": direct_ids}}, {"user_id": 1}).to_list(100)] if direct_ids else []
-    level_3_count = await db.users.count_documents({"sponsor_id": {"$in": level_2_ids}, "access_level": {"$in": [3, 4]}}) if level_2_ids else 0
-    
-    # Team sales this month
-    month_start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0).isoformat()
-    all_team_ids = [user_id] + direct_ids + level_2_ids
+    return await cached_dashboard("leader", user["user_id"], lambda: build_leader_dashboard(request.app.db, user))
+
+async def build_leader_dashboard(db, user: dict) -> dict:
+    user_id = user["user_id"]
     
-    team_sales = await db.orders.aggregate([
-        {"$match": {"referrer_id": {"$in": all_team_ids}, "created_at": {"$gte": month_start}, "payment_status": "paid"}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
-    ]).to_list(1)
+    month_start = current_month_start()
     
-    # My commissions
-    my_commissions = await db.commissions.aggregate([
-        {"$match": {"user_id": user_id, "created_at": {"$gte": month_start}}},
-        {"$group": {"_id": "$status", "total": {"$sum": "$amount"}}}
-    ]).to_list(10)
+    # Team (3 levels) in one server-side traversal, fetched concurrently with my commissions
+    team_docs, my_commissions = await asyncio.gather(
+        aggregate_list(db.users, [
+            {"$match": {"user_id": user_id}},
+            {"$graphLookup": {
+                "from": "users",
+                "startWith": "$user_id",
+                "connectFromField": "user_id",
+                "connectToField": "sponsor_id",
+                "as": "team",
+                "maxDepth": 2,
+                "depthField": "lvl",
+                "restrictSearchWithMatch": {"access_level": {"$in": [3, 4]}}
+            }},
+            {"$project": {"_id": 0, "team.user_id": 1, "team.lvl": 1}}
+        ], 1),
+        aggregate_list(db.commissions, [
+            {"$match": {"user_id": user_id, "created_at": {"$gte": month_start}}},
+            {"$group": {"_id": "$status", "total": {"$sum": "$amount"}}}
+        ], 10)
+    )
     
     commissions_by_status = {c["_id"]: c["total"] for c in my_commissions}
     
-    # Top team members
-    top_team = await db.orders.aggregate([
-        {"$match": {"referrer_id": {"$in": direct_ids}, "created_at": {"$gte": month_start}, "payment_status": "paid"}},
-        {"$group": {"_id": "$referrer_id", "total_sales": {"$sum": "$total"}}},
-        {"$sort": {"total_sales": -1}},
-        {"$limit": 5}
-    ]).to_list(5)
+    team_by_level = {0: [], 1: [], 2: []}
+    for member in (team_docs[0]["team"] if team_docs else []):
+        team_by_level[member["lvl"]].append(member["user_id"])
+    
+    direct_ids = team_by_level[0]
+    level_2_ids = team_by_level[1]
+    direct_count = len(direct_ids)
+    level_2_count = len(level_2_ids)
+    level_3_count = len(team_by_level[2])
+    all_team_ids = [user_id] + direct_ids + level_2_ids
     
-    for tt in top_team:
-        user_data = await db.users.find_one({"user_id": tt["_id"]}, {"_id": 0, "name": 1})
-        if user_data:
-            tt["name"] = user_data.get("name")
+    team_sales, top_team = await asyncio.gather(
+        # Team sales this month
+        aggregate_list(db.orders, [
+            {"$match": {"referrer_id": {"$in": all_team_ids}, "created_at": {"$gte": month_start}, "payment_status": "paid"}},
+            {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+        ], 1),
+        # Top team members
+        aggregate_list(db.orders, [
+            {"$match": {"referrer_id": {"$in": direct_ids}, "created_at": {"$gte": month_start}, "payment_status": "paid"}},
+            {"$group": {"_id": "$referrer_id", "total_sales": {"$sum": "$total"}}},
+            {"$sort": {"total_sales": -1}},
+            {"$limit": 5},
+            {"$lookup": {
+                "from": "users",
+                "localField": "_id",
+                "foreignField": "user_id",
+                "as": "u",
+                "pipeline": [{"$project": {"_id": 0, "name": 1}}]
+            }},
+            {"$unwind": {"path": "$u", "preserveNullAndEmptyArrays": True}},
+            {"$addFields": {"name": "$u.name"}},
+            {"$project": {"u": 0}}
+        ], 5)
+    )
     
     return {
         "team": {
@@ -2950,45 +3950,59 @@ async def leader_dashboard(request: Request, user: dict = Depends(get_current_us
 @app.get("/api/dashboard/client")
 async def client_dashboard(request: Request, user: dict = Depends(get_current_user)):
     """Dashboard for Client (Level 5) and Ambassador (Level 6)"""
-    db = request.app.db
+    return await cached_dashboard("client", user["user_id"], lambda: build_client_dashboard(request.app.db, user))
+
+async def build_client_dashboard(db, user: dict) -> dict:
     user_id = user["user_id"]
     
-    # My orders
-    orders_count = await db.orders.count_documents({"user_id": user_id})
-    orders_total = await db.orders.aggregate([
-        {"$match": {"user_id": user_id, "payment_status": "paid"}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}}}
-    ]).to_list(1)
-    
-    # Recent orders
-    recent_orders = await db.orders.find(
-        {"user_id": user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(5).to_list(5)
-    
-    # Referral stats (if client has any)
-    referral_sales = await db.orders.aggregate([
-        {"$match": {"referrer_id": user_id, "payment_status": "paid"}},
-        {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
-    ]).to_list(1)
-    
-    # Commissions earned
-    commissions = await db.commissions.aggregate([
-        {"$match": {"user_id": user_id}},
-        {"$group": {"_id": "$status", "total": {"$sum": "$amount"}}}
-    ]).to_list(10)
+    order_stats, commissions = await asyncio.gather(
+        # All order figures in one pass over the client's own and referred orders
+        aggregate_list(db.orders, [
+            {"$match": {"$or": [{"user_id": user_id}, {"referrer_id": user_id}]}},
+            {"$facet": {
+                # My orders
+                "mine": [
+                    {"$match": {"user_id": user_id}},
+                    {"$group": {
+                        "_id": None,
+                        "count": {"$sum": 1},
+                        "total_spent": {"$sum": {"$cond": [{"$eq": ["$payment_status", "paid"]}, "$total", 0]}}
+                    }}
+                ],
+                # Recent orders
+                "recent": [
+                    {"$match": {"user_id": user_id}},
+                    {"$sort": {"created_at": -1}},
+                    {"$limit": 5},
+                    {"$project": RECENT_ORDER_PROJECTION}
+                ],
+                # Referral stats (if client has any)
+                "referrals": [
+                    {"$match": {"referrer_id": user_id, "payment_status": "paid"}},
+                    {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+                ]
+            }}
+        ], 1),
+        # Commissions earned
+        aggregate_list(db.commissions, [
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": "$status", "total": {"$sum": "$amount"}}}
+        ], 10)
+    )
     
+    mine = order_stats[0]["mine"][0] if order_stats[0]["mine"] else {}
+    referral_sales = order_stats[0]["referrals"][0] if order_stats[0]["referrals"] else {}
     commissions_by_status = {c["_id"]: c["total"] for c in commissions}
     
     return {
         "orders": {
-            "count": orders_count,
-            "total_spent": orders_total[0]["total"] if orders_total else 0
+            "count": mine.get("count", 0),
+            "total_spent": mine.get("total_spent", 0)
         },
-        "recent_orders": recent_orders,
+        "recent_orders": order_stats[0]["recent"],
         "referrals": {
-            "sales": referral_sales[0]["total"] if referral_sales else 0,
-            "count": referral_sales[0]["count"] if referral_sales else 0
+            "sales": referral_sales.get("total", 0),
+            "count": referral_sales.get("count", 0)
         },
         "commissions": {
             "available": commissions_by_status.get("available", 0),
@@ -3000,34 +4014,64 @@ async def client_dashboard(request: Request, user: dict = Depends(get_current_us
 
 # ==================== SCHEDULER STATUS ====================
 
+SCHEDULER_STATUS_CACHE_TTL = 10
+_scheduler_status_cache = {"value": None, "ts": 0.0}
+
 @app.get("/api/admin/scheduler-status")
 async def get_scheduler_status(request: Request, user: dict = Depends(require_access_level(0))):
     """Get status of scheduled jobs"""
-    db = request.app.db
-    
-    # Get last run times from logs
-    last_qualification = await db.logs.find_one(
-        {"action": {"$in": ["qualifications_checked", "scheduled_qualifications_checked"]}},
-        {"_id": 0},
-        sort=[("created_at", -1)]
+    if _scheduler_status_cache["value"] is not None and time.monotonic() - _scheduler_status_cache["ts"] < SCHEDULER_STATUS_CACHE_TTL:
+        return _scheduler_status_cache["value"]
+    
+    status = await compute_scheduler_status(request.app.db)
+    _scheduler_status_cache["value"] = status
+    _scheduler_status_cache["ts"] = time.monotonic()
+    return status
+
+async def compute_scheduler_status(db) -> dict:
+    """Build the scheduler status payload"""
+    (
+        last_qualification,
+        last_commission_release,
+        last_goals_process,
+        pending_counts
+    ) = await asyncio.gather(
+        # Get last run times from logs
+        db.logs.find_one(
+            {"action": {"$in": ["qualifications_checked", "scheduled_qualifications_checked"]}},
+            {"_id": 0},
+            sort=[("created_at", -1)]
+        ),
+        db.logs.find_one(
+            {"action": {"$in": ["commissions_released", "scheduled_commissions_released"]}},
+            {"_id": 0},
+            sort=[("created_at", -1)]
+        ),
+        db.logs.find_one(
+            {"action": "goals_processed"},
+            {"_id": 0},
+            sort=[("created_at", -1)]
+        ),
+        # Pending items across the three collections in one round trip
+        aggregate_list(db.commissions, [
+            {"$match": {"status": "blocked"}},
+            {"$count": "count"},
+            {"$set": {"key": "commissions"}},
+            {"$unionWith": {"coll": "withdrawals", "pipeline": [
+                {"$match": {"status": "pending"}},
+                {"$count": "count"},
+                {"$set": {"key": "withdrawals"}}
+            ]}},
+            {"$unionWith": {"coll": "goals", "pipeline": [
+                {"$match": {"active": True, "processed": {"$ne": True}}},
+                {"$count": "count"},
+                {"$set": {"key": "goals"}}
+            ]}}
+        ], 3)
     )
     
-    last_commission_release = await db.logs.find_one(
-        {"action": {"$in": ["commissions_released", "scheduled_commissions_released"]}},
-        {"_id": 0},
-        sort=[("created_at", -1)]
-    )
-    
-    last_goals_process = await db.logs.find_one(
-        {"action": "goals_processed"},
-        {"_id": 0},
-        sort=[("created_at", -1)]
-    )
-    
-    # Pending items
-    pending_commissions = await db.commissions.count_documents({"status": "blocked"})
-    pending_withdrawals = await db.withdrawals.count_documents({"status": "pending"})
-    active_goals = await db.goals.count_documents({"active": True, "processed": {"$ne": True}})
+    # $count emits nothing for an empty match, so missing keys mean zero
+    pending = {p["key"]: p["count"] for p in pending_counts}
     
     # Scheduler jobs info
     jobs_info = []
@@ -3047,9 +4091,9 @@ async def get_scheduler_status(request: Request, user: dict = Depends(require_ac
             "goals_processing": last_goals_process.get("created_at") if last_goals_process else None
         },
         "pending": {
-            "commissions_to_release": pending_commissions,
-            "withdrawals_to_process": pending_withdrawals,
-            "goals_to_process": active_goals
+            "commissions_to_release": pending.get("commissions", 0),
+            "withdrawals_to_process": pending.get("withdrawals", 0),
+            "goals_to_process": pending.get("goals", 0)
         }
     }
 
@@ -3060,9 +4104,15 @@ async def run_job_manually(request: Request, job_id: str, user: dict = Depends(r
     
     if job_id == "release_commissions":
         await release_commissions_job(db)
+        invalidate_admin_dashboard_cache()
+        invalidate_dashboard_cache()
+        _scheduler_status_cache["ts"] = 0.0
         return {"message": "Commission release job executed"}
     elif job_id == "check_qualifications":
         await check_qualifications_job(db)
+        invalidate_admin_dashboard_cache()
+        invalidate_dashboard_cache()
+        _scheduler_status_cache["ts"] = 0.0
         return {"message": "Qualification check job executed"}
     else:
         raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
@@ -3074,39 +4124,43 @@ async def get_notifications(request: Request, user: dict = Depends(get_current_u
     """Get user's in-app notifications"""
     db = request.app.db
     
-    notifications = await db.notifications.find(
-        {"user_id": user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+    result = await aggregate_list(db.notifications, [
+        {"$match": {"user_id": user["user_id"]}},
+        {"$facet": {
+            "notifications": [
+                {"$sort": {"created_at": -1}},
+                {"$limit": limit},
+                {"$project": {"_id": 0}}
+            ],
+            "unread": [
+                {"$match": {"read": False}},
+                {"$count": "count"}
+            ]
+        }}
+    ], 1)
     
-    unread_count = await db.notifications.count_documents({
-        "user_id": user["user_id"],
-        "read": False
-    })
+    notifications = result[0]["notifications"]
+    unread_count = result[0]["unread"][0]["count"] if result[0]["unread"] else 0
     
     return {"notifications": notifications, "unread_count": unread_count}
 
 @app.get("/api/notifications/unread-count")
 async def get_unread_count(request: Request, user: dict = Depends(get_current_user)):
     """Get count of unread notifications"""
-    db = request.app.db
-    
-    count = await db.notifications.count_documents({
-        "user_id": user["user_id"],
-        "read": False
-    })
-    
-    return {"count": count}
+    # Maintained on the user document, which get_current_user already loaded
+    return {"count": max(user.get("unread_notifications", 0), 0)}
 
 @app.post("/api/notifications/{notification_id}/read")
 async def mark_notification_read(request: Request, notification_id: str, user: dict = Depends(get_current_user)):
     """Mark a notification as read"""
     db = request.app.db
     
-    await db.notifications.update_one(
-        {"notification_id": notification_id, "user_id": user["user_id"]},
-        {"$set": {"read": True, "read_at": datetime.now(timezone.utc).isoformat()}}
+    result = await db.notifications.update_one(
+        {"notification_id": notification_id, "user_id": user["user_id"], "read": False},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
     )
+    if result.modified_count:
+        await db.users.update_one({"user_id": user["user_id"]}, {"$inc": {"unread_notifications": -1}})
     
     return {"message": "Notification marked as read"}
 
@@ -3115,10 +4169,12 @@ async def mark_all_notifications_read(request: Request, user: dict = Depends(get
     """Mark all notifications as read"""
     db = request.app.db
     
-    await db.notifications.update_many(
+    result = await db.notifications.update_many(
         {"user_id": user["user_id"], "read": False},
-        {"$set": {"read": True, "read_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
     )
+    if result.modified_count:
+        await db.users.update_one({"user_id": user["user_id"]}, {"$inc": {"unread_notifications": -result.modified_count}})
     
     return {"message": "All notifications marked as read"}
 
@@ -3132,10 +4188,11 @@ async def create_notification(db, user_id: str, title: str, body: str, notificat
         "type": notification_type,
         "data": data or {},
         "read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.notifications.insert_one(notification)
+    await db.users.update_one({"user_id": user_id}, {"$inc": {"unread_notifications": 1}})
     return notification
 
 # ==================== SUPPORT TICKETS ====================
@@ -3165,8 +4222,8 @@ async def create_ticket(request: Request, data: TicketCreate, user: dict = Depen
         "priority": data.priority,
         "status": "open",  # open, in_progress, resolved, closed
         "assigned_to": None,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.tickets.insert_one(ticket)
@@ -3187,16 +4244,16 @@ async def create_ticket(request: Request, data: TicketCreate, user: dict = Depen
             {"url": f"/support/{ticket['ticket_id']}", "ticket_id": ticket["ticket_id"]}
         )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "ticket_created",
         "user_id": user["user_id"],
         "details": {"ticket_id": ticket["ticket_id"], "subject": data.subject, "category": data.category},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    ticket_response = await db.tickets.find_one({"ticket_id": ticket["ticket_id"]}, {"_id": 0})
-    return ticket_response
+    ticket.pop("_id", None)
+    return ticket
 
 @app.get("/api/tickets")
 async def list_tickets(
@@ -3292,13 +4349,13 @@ async def reply_to_ticket(request: Request, ticket_id: str, data: TicketReply, u
         "user_id": user["user_id"],
         "message": data.message,
         "is_staff": is_staff,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.ticket_replies.insert_one(reply)
     
     # Update ticket status and timestamp
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     if is_staff and ticket["status"] == "open":
         update_data["status"] = "in_progress"
         update_data["assigned_to"] = user["user_id"]
@@ -3316,13 +4373,13 @@ async def reply_to_ticket(request: Request, ticket_id: str, data: TicketReply, u
             "ticket_reply",
             {"url": f"/support/{ticket_id}", "ticket_id": ticket_id}
         )
-        await send_push_notification(
+        run_in_background(send_push_notification(
             db,
             ticket["user_id"],
             "Nova Resposta no seu Ticket 💬",
             f"Sua solicitação '{ticket['subject']}' recebeu uma resposta!",
             {"url": f"/support/{ticket_id}", "type": "ticket_reply"}
-        )
+        ))
     else:
         # Ticket owner replied, notify staff
         admins_and_supervisors = await db.users.find(
@@ -3340,16 +4397,16 @@ async def reply_to_ticket(request: Request, ticket_id: str, data: TicketReply, u
                 {"url": f"/support/{ticket_id}", "ticket_id": ticket_id}
             )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "ticket_replied",
         "user_id": user["user_id"],
         "details": {"ticket_id": ticket_id},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
-    reply_response = await db.ticket_replies.find_one({"reply_id": reply["reply_id"]}, {"_id": 0})
-    return reply_response
+    reply.pop("_id", None)
+    return reply
 
 @app.put("/api/tickets/{ticket_id}/status")
 async def update_ticket_status(
@@ -3371,7 +4428,7 @@ async def update_ticket_status(
     
     await db.tickets.update_one(
         {"ticket_id": ticket_id},
-        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Notify ticket owner
@@ -3384,12 +4441,12 @@ async def update_ticket_status(
         {"url": f"/support/{ticket_id}", "ticket_id": ticket_id}
     )
     
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "ticket_status_updated",
         "user_id": user["user_id"],
         "details": {"ticket_id": ticket_id, "new_status": status},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Ticket status updated"}
@@ -3462,7 +4519,8 @@ class ConnectionManager:
         if user_id in self.active_connections:
             for connection in self.active_connections[user_id]:
                 try:
-                    await connection.send_json(message)
+                    # orjson encodes the stored datetimes; default=str covers the ObjectId insert_one adds
+                    await connection.send_text(orjson.dumps(message, default=str).decode())
                 except Exception as e:
                     logger.error(f"Error sending message to {user_id}: {e}")
     
@@ -3522,8 +4580,8 @@ async def create_conversation(request: Request, data: ConversationCreate, user:
                 user["user_id"]: user.get("name"),
                 data.participant_id: participant.get("name")
             },
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "last_message_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "last_message_at": datetime.now(timezone.utc)
         }
         await db.conversations.insert_one(conversation)
         conversation_id = conversation["conversation_id"]
@@ -3535,9 +4593,10 @@ async def create_conversation(request: Request, data: ConversationCreate, user:
         "sender_id": user["user_id"],
         "content": data.message,
         "read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.messages.insert_one(message)
+    message.pop("_id", None)
     
     # Update conversation last message
     await db.conversations.update_one(
@@ -3566,9 +4625,7 @@ async def create_conversation(request: Request, data: ConversationCreate, user:
         {"url": f"/chat/{conversation_id}", "conversation_id": conversation_id}
     )
     
-    # Re-fetch message without _id
-    message_response = await db.messages.find_one({"message_id": message["message_id"]}, {"_id": 0})
-    return {"conversation_id": conversation_id, "message": message_response}
+    return {"conversation_id": conversation_id, "message": message}
 
 @app.get("/api/chat/conversations")
 async def list_conversations(request: Request, user: dict = Depends(get_current_user)):
@@ -3635,7 +4692,7 @@ async def get_conversation_messages(
             "sender_id": {"$ne": user["user_id"]},
             "read": False
         },
-        {"$set": {"read": True, "read_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
     )
     
     return {
@@ -3670,9 +4727,10 @@ async def send_message(
         "sender_id": user["user_id"],
         "content": message,
         "read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.messages.insert_one(msg)
+    msg.pop("_id", None)
     
     # Update conversation
     await db.conversations.update_one(
@@ -3702,16 +4760,15 @@ async def send_message(
         {"url": f"/chat/{conversation_id}", "conversation_id": conversation_id}
     )
     
-    await send_push_notification(
+    run_in_background(send_push_notification(
         db,
         other_id,
         f"Nova Mensagem de {user.get('name')} 💬",
         message[:100],
         {"url": f"/chat/{conversation_id}", "type": "chat"}
-    )
+    ))
     
-    msg_response = await db.messages.find_one({"message_id": msg["message_id"]}, {"_id": 0})
-    return msg_response
+    return msg
 
 @app.websocket("/ws/chat/{user_id}")
 async def websocket_chat_endpoint(websocket: WebSocket, user_id: str):
@@ -3837,13 +4894,13 @@ async def send_realtime_notification(db, user_id: str, notification: dict):
     
     # Fallback to push notification if offline
     if user_id not in manager.active_connections:
-        await send_push_notification(
+        run_in_background(send_push_notification(
             db,
             user_id,
             notification.get("title", ""),
             notification.get("body", ""),
             notification.get("data")
-        )
+        ))
 
 # ==================== PUSH NOTIFICATIONS ====================
 
@@ -3867,7 +4924,7 @@ async def subscribe_to_notifications(request: Request, data: PushSubscription, u
         "user_id": user["user_id"],
         "endpoint": data.subscription.get("endpoint"),
         "keys": data.subscription.get("keys"),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     # Update or insert subscription
@@ -3878,12 +4935,12 @@ async def subscribe_to_notifications(request: Request, data: PushSubscription, u
     )
     
     # Log the subscription
-    await db.logs.insert_one({
+    log_event({
         "log_id": generate_id("log_"),
         "action": "push_subscribed",
         "user_id": user["user_id"],
         "details": {"endpoint": subscription_data["endpoint"][:50] + "..."},
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     return {"message": "Subscribed to notifications"}
@@ -3905,13 +4962,10 @@ async def get_notification_status(request: Request, user: dict = Depends(get_cur
     """Check if user is subscribed to push notifications"""
     db = request.app.db
     
-    subscription = await db.push_subscriptions.find_one(
-        {"user_id": user["user_id"]},
-        {"_id": 0, "endpoint": 1}
-    )
+    subscribed = await db.push_subscriptions.count_documents({"user_id": user["user_id"]}, limit=1) > 0
     
     return {
-        "subscribed": subscription is not None,
+        "subscribed": subscribed,
         "vapid_public_key": VAPID_PUBLIC_KEY
     }
 
@@ -3923,36 +4977,50 @@ async def send_push_notification(db, user_id: str, title: str, body: str, data:
         logger.info(f"No push subscriptions for user {user_id}")
         return
     
+    # pywebpush pulls in cryptography/requests; only load it once a push is actually sent
+    from pywebpush import webpush, WebPushException
+    
     payload = {
         "title": title,
         "body": body,
         "icon": "/icon-192x192.png",
         "badge": "/icon-72x72.png",
-        "tag": f"vanguard-{datetime.now().timestamp()}",
+        "tag": f"vanguard-{time.time_ns()}",
         "data": data or {}
     }
+    payload_data = json.dumps(payload, separators=(",", ":"))
     
-    for sub in subscriptions:
-        try:
-            subscription_info = {
+    def send(sub):
+        webpush(
+            subscription_info={
                 "endpoint": sub["endpoint"],
                 "keys": sub["keys"]
-            }
-            
-            webpush(
-                subscription_info=subscription_info,
-                data=str(payload).replace("'", '"'),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            logger.info(f"Push notification sent to user {user_id}")
-        except WebPushException as e:
-            logger.error(f"Push notification failed: {e}")
+            },
+            data=payload_data,
+            vapid_private_key=VAPID_PRIVATE_KEY,
+            vapid_claims=VAPID_CLAIMS
+        )
+    
+    # webpush is blocking; send to all endpoints concurrently off the event loop
+    results = await asyncio.gather(
+        *(asyncio.to_thread(send, sub) for sub in subscriptions),
+        return_exceptions=True
+    )
+    
+    invalid_endpoints = []
+    for sub, result in zip(subscriptions, results):
+        if isinstance(result, WebPushException):
+            logger.error(f"Push notification failed: {result}")
             # Remove invalid subscription
-            if e.response and e.response.status_code in [404, 410]:
-                await db.push_subscriptions.delete_one({"endpoint": sub["endpoint"]})
-        except Exception as e:
-            logger.error(f"Push notification error: {e}")
+            if result.response is not None and result.response.status_code in [404, 410]:
+                invalid_endpoints.append(sub["endpoint"])
+        elif isinstance(result, Exception):
+            logger.error(f"Push notification error: {result}")
+        else:
+            logger.info(f"Push notification sent to user {user_id}")
+    
+    if invalid_endpoints:
+        await db.push_subscriptions.delete_many({"endpoint": {"$in": invalid_endpoints}})
 
 @app.post("/api/admin/send-notification")
 async def send_admin_notification(request: Request, user: dict = Depends(require_access_level(0))):
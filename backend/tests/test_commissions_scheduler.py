@@ -11,6 +11,11 @@ Features tested:
 import pytest
 import requests
 import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 
@@ -182,6 +187,7 @@ class TestSchedulerStatus:
         job_ids = [job["id"] for job in data["jobs"]]
         assert "release_commissions" in job_ids, "release_commissions job should be registered"
         assert "check_qualifications" in job_ids, "check_qualifications job should be registered"
+        assert "reconcile_paid_orders" in job_ids, "reconcile_paid_orders job should be registered"
         
         print(f"✓ Scheduler is running with {len(data['jobs'])} jobs registered")
         print(f"  Jobs: {job_ids}")
@@ -251,6 +257,173 @@ class TestManualJobExecution:
         print("✓ Manual job execution requires admin access")
 
 
+@pytest.fixture(scope="module")
+def db():
+    """Direct handle on the server's database, to seed release states the API cannot produce"""
+    client = MongoClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"), serverSelectionTimeoutMS=3000, tz_aware=True)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip("MongoDB not reachable")
+    yield client[os.environ.get("DB_NAME", "mlm_vanguard")]
+    client.close()
+
+
+class TestCommissionReleaseIdempotency:
+    """Released commissions are credited exactly once, even across crashes and re-runs"""
+    
+    def create_reseller(self, admin_token, blocked_balance):
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"TEST_rel_{uuid.uuid4().hex[:10]}@test.com",
+            "password": "teste123",
+            "name": "TEST_Release",
+            "access_level": 4
+        })
+        assert response.status_code == 200
+        user = response.json()["user"]
+        response = requests.put(
+            f"{BASE_URL}/api/users/{user['user_id']}",
+            json={"blocked_balance": blocked_balance},
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        return user["user_id"]
+    
+    def balances(self, admin_token, user_id):
+        response = requests.get(
+            f"{BASE_URL}/api/users/{user_id}",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        return data["available_balance"], data["blocked_balance"]
+    
+    def commission(self, user_id, amount, **fields):
+        now = datetime.now(timezone.utc)
+        return {
+            "commission_id": f"comm_TEST_{uuid.uuid4().hex[:12]}",
+            "user_id": user_id,
+            "order_id": f"order_TEST_{uuid.uuid4().hex[:8]}",
+            "level": 1,
+            "rate": 10,
+            "base_amount": amount * 10,
+            "amount": amount,
+            "status": "blocked",
+            "release_at": now - timedelta(days=1),
+            "created_at": now - timedelta(days=8),
+            **fields
+        }
+    
+    def run_release_job(self, admin_token):
+        response = requests.post(
+            f"{BASE_URL}/api/admin/run-job/release_commissions",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+    
+    def test_reconcile_finishes_half_credited_batch(self, admin_token, db):
+        """A batch flipped to available but only partly credited is finished once"""
+        credited_user = self.create_reseller(admin_token, 0)
+        pending_user = self.create_reseller(admin_token, 40)
+        batch_id = f"rel_TEST_{uuid.uuid4().hex[:8]}"
+        now = datetime.now(timezone.utc)
+        
+        # Crash after the status flip, with one of the two users already credited
+        db.users.update_one(
+            {"user_id": credited_user},
+            {"$inc": {"available_balance": 25}, "$push": {"credit_batches": batch_id}}
+        )
+        db.commissions.insert_many([
+            self.commission(credited_user, 25, status="available", released_at=now, credit_batch=batch_id, credited=False),
+            self.commission(pending_user, 40, status="available", released_at=now, credit_batch=batch_id, credited=False),
+        ])
+        
+        self.run_release_job(admin_token)
+        
+        assert self.balances(admin_token, credited_user) == (25, 0)
+        assert self.balances(admin_token, pending_user) == (40, 0)
+        assert db.commissions.count_documents({"credit_batch": batch_id, "credited": False}) == 0
+        assert db.transactions.count_documents({"type": "commission_released", "user_id": pending_user}) == 1
+        
+        # Reconciling again finds nothing left to credit
+        self.run_release_job(admin_token)
+        assert self.balances(admin_token, credited_user) == (25, 0)
+        assert self.balances(admin_token, pending_user) == (40, 0)
+        print("✓ Half-credited release batch finished exactly once")
+    
+    def test_repeated_release_does_not_double_credit(self, admin_token, db):
+        """Running the job and the manual release repeatedly credits a commission once"""
+        user_id = self.create_reseller(admin_token, 30)
+        commission = self.commission(user_id, 30)
+        db.commissions.insert_one(dict(commission))
+        
+        self.run_release_job(admin_token)
+        self.run_release_job(admin_token)
+        response = requests.post(
+            f"{BASE_URL}/api/admin/process-commissions",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        
+        assert self.balances(admin_token, user_id) == (30, 0)
+        stored = db.commissions.find_one({"commission_id": commission["commission_id"]})
+        assert stored["status"] == "available"
+        assert stored["credited"] is True
+        assert db.transactions.count_documents({"type": "commission_released", "reference_id": commission["commission_id"]}) == 1
+        print("✓ Repeated releases credited the commission once")
+
+
+class TestPaidOrderRetry:
+    """Paying an order again finishes side effects an interrupted attempt left undone"""
+    
+    def test_retry_paid_finishes_interrupted_order(self, admin_token, db):
+        """An order stuck with commissions_processed=False is finished once by a retry"""
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"TEST_ord_{uuid.uuid4().hex[:10]}@test.com",
+            "password": "teste123",
+            "name": "TEST_Indicador",
+            "access_level": 4
+        })
+        assert response.status_code == 200
+        referrer_id = response.json()["user"]["user_id"]
+        
+        # The status flip to paid committed, then the request failed before any side effect
+        now = datetime.now(timezone.utc)
+        order_id = f"ord_TEST_{uuid.uuid4().hex[:10]}"
+        db.orders.insert_one({
+            "order_id": order_id,
+            "user_id": referrer_id,
+            "items": [],
+            "subtotal": 100.0,
+            "shipping": 15.0,
+            "total": 115.0,
+            "commission_base": 100.0,
+            "referrer_id": referrer_id,
+            "referrer_type": "revendedor",
+            "payment_status": "paid",
+            "order_status": "paid",
+            "paid_at": now,
+            "commissions_processed": False,
+            "created_at": now
+        })
+        
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.put(f"{BASE_URL}/api/orders/{order_id}/status", params={"status": "paid"}, headers=headers)
+        assert response.status_code == 200
+        
+        # Once processed, paying again is a conflict and changes nothing
+        response = requests.put(f"{BASE_URL}/api/orders/{order_id}/status", params={"status": "paid"}, headers=headers)
+        assert response.status_code == 409
+        
+        assert db.orders.find_one({"order_id": order_id})["commissions_processed"] is True
+        commissions = list(db.commissions.find({"order_id": order_id}))
+        assert [(c["user_id"], c["level"]) for c in commissions] == [(referrer_id, 1)]
+        referrer = db.users.find_one({"user_id": referrer_id})
+        assert referrer["blocked_balance"] == commissions[0]["amount"]
+        assert referrer["personal_volume"] == 100.0
+        print("✓ Retried payment finished the interrupted order once")
+
+
 class TestExistingEndpoints:
     """Verify existing endpoints still work (regression test)"""
     
@@ -5,14 +5,32 @@ Tests for authentication, orders, withdrawals, and dashboard APIs
 
 import pytest
 import requests
+import csv
+import io
 import os
 import time
+import uuid
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://push-notify-12.preview.emergentagent.com').rstrip('/')
 
 # Test credentials
 ADMIN_EMAIL = "admin@vanguard.com"
 ADMIN_PASSWORD = "admin123"
+TEST_PASSWORD = "test123456"
+
+
+def register_test_user(access_level=5, name="TEST_Usuario", sponsor=None):
+    """Register a throwaway TEST_ user, optionally under sponsor, and return (user, token)"""
+    res = requests.post(f"{BASE_URL}/api/auth/register", json={
+        "email": f"TEST_{uuid.uuid4().hex[:10]}@test.com",
+        "password": TEST_PASSWORD,
+        "name": name,
+        "access_level": access_level,
+        "sponsor_code": sponsor["referral_code"] if sponsor else None
+    })
+    assert res.status_code == 200, f"Register failed: {res.text}"
+    data = res.json()
+    return data["user"], data["token"]
 
 
 class TestHealth:
@@ -151,7 +169,46 @@ class TestOrders:
             assert order.get("order_status") == "pending", f"Found non-pending order: {order.get('order_id')}"
         
         print(f"✅ Filtered orders by status: found {len(data['orders'])} pending orders")
-    
+
+    def test_list_orders_cursor_pagination(self, admin_token):
+        """Test keyset pagination with next_cursor matches page-based results"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        res = requests.get(f"{BASE_URL}/api/orders?page=1&limit=2", headers=headers)
+        assert res.status_code == 200
+        first = res.json()
+        assert "next_cursor" in first, "next_cursor missing"
+
+        if not first["next_cursor"]:
+            pytest.skip("Not enough orders to paginate")
+
+        res = requests.get(f"{BASE_URL}/api/orders?limit=2&cursor={first['next_cursor']}", headers=headers)
+        assert res.status_code == 200
+        by_cursor = res.json()["orders"]
+
+        res = requests.get(f"{BASE_URL}/api/orders?page=2&limit=2", headers=headers)
+        by_page = res.json()["orders"]
+
+        assert [o["order_id"] for o in by_cursor] == [o["order_id"] for o in by_page]
+        print(f"✅ Cursor pagination returned {len(by_cursor)} orders matching page 2")
+
+    def test_list_orders_invalid_cursor(self, admin_token):
+        """Test a malformed cursor is rejected"""
+        res = requests.get(f"{BASE_URL}/api/orders?limit=2&cursor=not-a-cursor", headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 400
+        print("✅ Invalid cursor correctly rejected")
+
+    def test_create_order_without_items(self, admin_token):
+        """Test an order with no items is rejected with 400"""
+        res = requests.post(f"{BASE_URL}/api/orders", json={
+            "items": [],
+            "shipping_address": {"street": "Rua Teste", "city": "São Paulo", "state": "SP", "zip": "01000-000"},
+            "payment_method": "pix"
+        }, headers={"Authorization": f"Bearer {admin_token}"})
+        assert res.status_code == 400, f"Expected 400, got {res.status_code}: {res.text}"
+        print("✅ Empty order correctly rejected")
+
     def test_orders_requires_auth(self):
         """Test /api/orders requires authentication"""
         res = requests.get(f"{BASE_URL}/api/orders")
@@ -385,5 +442,625 @@ class TestCreateOrderFlow:
         print("✅ Test product cleaned up")
 
 
+class TestWithdrawalTransitions:
+    """Withdrawal status changes only follow the allowed transitions"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    def request_withdrawal(self, admin_token, amount=100):
+        """Fund a new TEST_ user and have them request a withdrawal"""
+        user, token = register_test_user()
+        res = requests.put(f"{BASE_URL}/api/users/{user['user_id']}", json={
+            "available_balance": 500,
+            "bank_info": {"bank": "001", "agency": "0001", "account": "12345-6", "pix_key": user["email"]}
+        }, headers={"Authorization": f"Bearer {admin_token}"})
+        assert res.status_code == 200, f"Update user failed: {res.text}"
+        
+        res = requests.post(f"{BASE_URL}/api/wallet/withdraw", json={"amount": amount}, headers={
+            "Authorization": f"Bearer {token}"
+        })
+        assert res.status_code == 200, f"Withdraw failed: {res.text}"
+        return res.json(), token
+    
+    def set_status(self, admin_token, withdrawal_id, status):
+        return requests.put(f"{BASE_URL}/api/wallet/withdrawals/{withdrawal_id}", params={"status": status}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+    
+    def test_pending_approved_paid(self, admin_token):
+        """Test pending -> approved -> paid, and that a paid withdrawal is final"""
+        withdrawal, _ = self.request_withdrawal(admin_token)
+        wd_id = withdrawal["withdrawal_id"]
+        assert withdrawal["status"] == "pending"
+        
+        # A pending withdrawal cannot be paid before it is approved
+        assert self.set_status(admin_token, wd_id, "paid").status_code == 409
+        assert self.set_status(admin_token, wd_id, "approved").status_code == 200
+        assert self.set_status(admin_token, wd_id, "approved").status_code == 409
+        assert self.set_status(admin_token, wd_id, "paid").status_code == 200
+        
+        for status in ("approved", "paid", "rejected"):
+            res = self.set_status(admin_token, wd_id, status)
+            assert res.status_code == 409, f"paid -> {status} should be rejected: {res.text}"
+        
+        print("✅ Paid withdrawal can no longer change status")
+    
+    def test_rejected_refunds_once(self, admin_token):
+        """Test rejecting twice returns 409 and refunds the balance only once"""
+        withdrawal, token = self.request_withdrawal(admin_token)
+        wd_id = withdrawal["withdrawal_id"]
+        
+        assert self.set_status(admin_token, wd_id, "rejected").status_code == 200
+        res = self.set_status(admin_token, wd_id, "rejected")
+        assert res.status_code == 409, f"Second rejection should conflict: {res.text}"
+        assert self.set_status(admin_token, wd_id, "approved").status_code == 409
+        
+        res = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+        assert res.status_code == 200
+        assert res.json()["available_balance"] == 500
+        
+        print("✅ Rejected withdrawal refunded exactly once")
+    
+    def test_invalid_status_and_unknown_withdrawal(self, admin_token):
+        """Test unknown statuses return 400 and unknown withdrawals 404"""
+        res = self.set_status(admin_token, "wd_doesnotexist", "approved")
+        assert res.status_code == 404
+        
+        res = self.set_status(admin_token, "wd_doesnotexist", "pending")
+        assert res.status_code == 400
+        
+        print("✅ Invalid withdrawal updates correctly rejected")
+
+
+class TestListTotals:
+    """Optional totals and has_more on paginated lists"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    @pytest.mark.parametrize("path,key", [
+        ("/api/orders", "orders"),
+        ("/api/commissions", "commissions"),
+        ("/api/wallet/withdrawals", "withdrawals"),
+        ("/api/logs", "logs"),
+    ])
+    def test_include_total_false_skips_count(self, admin_token, path, key):
+        """Test include_total=false leaves total/pages empty but still reports has_more"""
+        res = requests.get(f"{BASE_URL}{path}", params={"limit": 5, "include_total": "false"}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"List {key} failed: {res.text}"
+        data = res.json()
+        
+        assert data["total"] is None
+        assert data["pages"] is None
+        assert isinstance(data["has_more"], bool)
+        assert data["has_more"] == (data["next_cursor"] is not None)
+        assert len(data[key]) <= 5
+        
+        print(f"✅ {path} without total: has_more={data['has_more']}")
+    
+    @pytest.mark.parametrize("path,key", [
+        ("/api/orders", "orders"),
+        ("/api/commissions", "commissions"),
+        ("/api/wallet/withdrawals", "withdrawals"),
+        ("/api/logs", "logs"),
+    ])
+    def test_has_more_matches_total(self, admin_token, path, key):
+        """Test has_more and pages agree with the total on the first page"""
+        res = requests.get(f"{BASE_URL}{path}", params={"limit": 1}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"List {key} failed: {res.text}"
+        data = res.json()
+        
+        assert isinstance(data["total"], int)
+        assert data["pages"] == data["total"]
+        assert data["has_more"] == (data["total"] > 1)
+        
+        print(f"✅ {path}: total={data['total']}, has_more={data['has_more']}")
+
+
+class TestDateFilters:
+    """Date query parameters are validated instead of compared as strings"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    @pytest.mark.parametrize("path", [
+        "/api/admin/withdrawals/report",
+        "/api/export/sales",
+        "/api/export/commissions",
+    ])
+    @pytest.mark.parametrize("param", ["start_date", "end_date"])
+    def test_invalid_date_returns_400(self, admin_token, path, param):
+        """Test an unparseable date filter returns 400"""
+        res = requests.get(f"{BASE_URL}{path}", params={param: "not-a-date"}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 400, f"Expected 400, got {res.status_code}: {res.text}"
+        print(f"✅ {path} rejects invalid {param}")
+    
+    @pytest.mark.parametrize("path", [
+        "/api/admin/withdrawals/report",
+        "/api/export/sales",
+        "/api/export/commissions",
+    ])
+    def test_valid_date_range(self, admin_token, path):
+        """Test ISO dates are accepted"""
+        res = requests.get(f"{BASE_URL}{path}", params={
+            "start_date": "2024-01-01",
+            "end_date": "2024-12-31T23:59:59Z"
+        }, headers={"Authorization": f"Bearer {admin_token}"})
+        assert res.status_code == 200, f"Date range failed: {res.text}"
+        print(f"✅ {path} accepts an ISO date range")
+    
+    def test_goal_with_invalid_date_returns_400(self, admin_token):
+        """Test creating a goal with a bad end_date returns 400"""
+        res = requests.post(f"{BASE_URL}/api/goals", json={
+            "name": "TEST_Meta",
+            "metric": "sales",
+            "target_value": 1000,
+            "bonus_amount": 50,
+            "start_date": "2024-01-01",
+            "end_date": "31/12/2024"
+        }, headers={"Authorization": f"Bearer {admin_token}"})
+        assert res.status_code == 400, f"Expected 400, got {res.status_code}: {res.text}"
+        print("✅ Goal with invalid date rejected")
+
+
+class TestExports:
+    """Streamed CSV/JSON report exports"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    def test_commissions_export_csv(self, admin_token):
+        """Test the commissions CSV has the joined user columns in its header"""
+        res = requests.get(f"{BASE_URL}/api/export/commissions", params={"format": "csv"}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"Export failed: {res.text}"
+        assert res.headers["content-type"].startswith("text/csv")
+        
+        rows = list(csv.reader(io.StringIO(res.text)))
+        assert rows[0] == [
+            "commission_id", "created_at", "user_id", "user_name", "user_email", "order_id",
+            "level", "rate", "base_amount", "amount", "status"
+        ]
+        assert all(len(row) == len(rows[0]) for row in rows[1:])
+        
+        print(f"✅ Commissions CSV export: {len(rows) - 1} rows")
+    
+    def test_commissions_export_json(self, admin_token):
+        """Test the commissions JSON export counts every streamed row"""
+        res = requests.get(f"{BASE_URL}/api/export/commissions", params={"format": "json"}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"Export failed: {res.text}"
+        data = res.json()
+        
+        assert data["total_count"] == len(data["commissions"])
+        for commission in data["commissions"]:
+            assert "_id" not in commission
+            assert "commission_id" in commission
+        
+        print(f"✅ Commissions JSON export: total_count={data['total_count']}")
+    
+    def test_sales_export_json(self, admin_token):
+        """Test the sales JSON export only contains paid orders"""
+        res = requests.get(f"{BASE_URL}/api/export/sales", params={"format": "json"}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"Export failed: {res.text}"
+        data = res.json()
+        
+        assert data["total_count"] == len(data["orders"])
+        for order in data["orders"]:
+            assert order["payment_status"] == "paid"
+        
+        print(f"✅ Sales JSON export: total_count={data['total_count']}")
+    
+    def test_users_export_escapes_csv(self, admin_token):
+        """Test names with commas and quotes survive the users CSV export"""
+        name = 'TEST_Silva, "Junior"'
+        user, _ = register_test_user(name=name)
+        
+        res = requests.get(f"{BASE_URL}/api/export/users", params={"format": "csv", "access_level": 5}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"Export failed: {res.text}"
+        
+        rows = list(csv.DictReader(io.StringIO(res.text)))
+        exported = [row for row in rows if row["user_id"] == user["user_id"]]
+        assert len(exported) == 1
+        assert exported[0]["name"] == name
+        assert "password" not in exported[0]
+        
+        print(f"✅ Users CSV export: {len(rows)} rows, quoted name preserved")
+    
+    def test_users_export_json(self, admin_token):
+        """Test the users JSON export counts every streamed row and omits passwords"""
+        res = requests.get(f"{BASE_URL}/api/export/users", params={"format": "json"}, headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 200, f"Export failed: {res.text}"
+        data = res.json()
+        
+        assert data["total_count"] == len(data["users"])
+        for exported in data["users"]:
+            assert "password" not in exported
+            assert "_id" not in exported
+        
+        print(f"✅ Users JSON export: total_count={data['total_count']}")
+    
+    def test_network_export(self, admin_token):
+        """Test the network export streams the downline with its levels"""
+        leader, leader_token = register_test_user(access_level=4, name="TEST_Lider")
+        
+        def sponsored(sponsor, name):
+            res = requests.post(f"{BASE_URL}/api/auth/register", json={
+                "email": f"TEST_{uuid.uuid4().hex[:10]}@test.com",
+                "password": TEST_PASSWORD,
+                "name": name,
+                "access_level": 4,
+                "sponsor_code": sponsor["referral_code"]
+            })
+            assert res.status_code == 200, f"Register failed: {res.text}"
+            return res.json()["user"]
+        
+        first = sponsored(leader, "TEST_Nivel1_A")
+        sponsored(leader, "TEST_Nivel1_B")
+        sponsored(first, "TEST_Nivel2")
+        
+        res = requests.get(f"{BASE_URL}/api/export/network/{leader['user_id']}", params={"format": "json"}, headers={
+            "Authorization": f"Bearer {leader_token}"
+        })
+        assert res.status_code == 200, f"Export failed: {res.text}"
+        data = res.json()
+        
+        assert data["total_count"] == 3
+        assert [member["network_level"] for member in data["network"]] == [1, 1, 2]
+        
+        res = requests.get(f"{BASE_URL}/api/export/network/{leader['user_id']}", params={"format": "csv"}, headers={
+            "Authorization": f"Bearer {leader_token}"
+        })
+        assert res.status_code == 200
+        rows = list(csv.reader(io.StringIO(res.text)))
+        assert rows[0][0] == "network_level"
+        assert len(rows) == 4
+        
+        print("✅ Network export streamed 3 downline members")
+
+class TestNotificationCounter:
+    """The unread counter kept on the user follows the notifications list"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    def unread(self, token):
+        """Return (counter, unread_count from the list) for a user"""
+        headers = {"Authorization": f"Bearer {token}"}
+        res = requests.get(f"{BASE_URL}/api/notifications/unread-count", headers=headers)
+        assert res.status_code == 200
+        counter = res.json()["count"]
+        
+        res = requests.get(f"{BASE_URL}/api/notifications", headers=headers)
+        assert res.status_code == 200
+        return counter, res.json()["unread_count"]
+    
+    def test_unread_counter(self, admin_token):
+        """Test the counter rises with staff replies and drops when marked read"""
+        _, token = register_test_user()
+        assert self.unread(token) == (0, 0)
+        
+        res = requests.post(f"{BASE_URL}/api/tickets", json={
+            "category": "Outros",
+            "subject": "TEST_Ticket",
+            "description": "Ticket para teste de notificações"
+        }, headers={"Authorization": f"Bearer {token}"})
+        assert res.status_code == 200, f"Create ticket failed: {res.text}"
+        ticket_id = res.json()["ticket_id"]
+        
+        # Each staff reply notifies the ticket owner
+        for _ in range(2):
+            res = requests.post(f"{BASE_URL}/api/tickets/{ticket_id}/reply", json={"message": "TEST_Resposta"}, headers={
+                "Authorization": f"Bearer {admin_token}"
+            })
+            assert res.status_code == 200, f"Reply failed: {res.text}"
+        assert self.unread(token) == (2, 2)
+        
+        res = requests.get(f"{BASE_URL}/api/notifications", headers={"Authorization": f"Bearer {token}"})
+        notification_id = res.json()["notifications"][0]["notification_id"]
+        
+        # Marking the same notification twice only decrements once
+        for _ in range(2):
+            res = requests.post(f"{BASE_URL}/api/notifications/{notification_id}/read", headers={
+                "Authorization": f"Bearer {token}"
+            })
+            assert res.status_code == 200
+        assert self.unread(token) == (1, 1)
+        
+        for _ in range(2):
+            res = requests.post(f"{BASE_URL}/api/notifications/read-all", headers={
+                "Authorization": f"Bearer {token}"
+            })
+            assert res.status_code == 200
+        assert self.unread(token) == (0, 0)
+        
+        print("✅ Unread counter matches the notifications list")
+
+
+class TestCursorPaging:
+    """Keyset cursors on the supervised users list and the audit log"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    def test_supervised_users_cursor(self, admin_token):
+        """Test following next_cursor walks every supervised user once, in name order"""
+        supervisor, supervisor_token = register_test_user(access_level=2, name="TEST_Supervisor")
+        
+        # Repeated and empty names exercise the _id tie-break and the string cursor
+        for name in ["TEST_Carla", "TEST_Ana", "TEST_Ana", "", "TEST_Bruno"]:
+            user, _ = register_test_user(name=name)
+            res = requests.put(f"{BASE_URL}/api/users/{user['user_id']}", json={
+                "supervisor_id": supervisor["user_id"]
+            }, headers={"Authorization": f"Bearer {admin_token}"})
+            assert res.status_code == 200, f"Assign supervisor failed: {res.text}"
+        
+        headers = {"Authorization": f"Bearer {supervisor_token}"}
+        res = requests.get(f"{BASE_URL}/api/supervisor/users", params={"limit": 50}, headers=headers)
+        assert res.status_code == 200, f"List supervised failed: {res.text}"
+        everyone = res.json()
+        assert everyone["total"] == 5
+        assert everyone["has_more"] is False
+        
+        walked = []
+        params = {"limit": 2, "include_total": "false"}
+        while True:
+            res = requests.get(f"{BASE_URL}/api/supervisor/users", params=params, headers=headers)
+            assert res.status_code == 200, f"Cursor page failed: {res.text}"
+            data = res.json()
+            assert len(data["users"]) <= 2
+            walked.extend(u["user_id"] for u in data["users"])
+            if not data["has_more"]:
+                break
+            params["cursor"] = data["next_cursor"]
+        
+        assert walked == [u["user_id"] for u in everyone["users"]]
+        assert len(set(walked)) == 5
+        
+        print(f"✅ Supervised users cursor walked {len(walked)} users in order")
+    
+    def test_supervised_users_requires_supervisor(self, admin_token):
+        """Test only supervisors can list supervised users"""
+        res = requests.get(f"{BASE_URL}/api/supervisor/users", headers={
+            "Authorization": f"Bearer {admin_token}"
+        })
+        assert res.status_code == 403
+        print("✅ Supervised users list restricted to supervisors")
+    
+    def test_logs_cursor(self, admin_token):
+        """Test the next log page by cursor does not repeat the first page"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        res = requests.get(f"{BASE_URL}/api/logs", params={"limit": 5}, headers=headers)
+        assert res.status_code == 200, f"List logs failed: {res.text}"
+        first = res.json()
+        if not first["has_more"]:
+            pytest.skip("Not enough logs for a second page")
+        
+        res = requests.get(f"{BASE_URL}/api/logs", params={"limit": 5, "cursor": first["next_cursor"]}, headers=headers)
+        assert res.status_code == 200, f"Cursor page failed: {res.text}"
+        second = res.json()
+        
+        first_ids = {log["log_id"] for log in first["logs"]}
+        assert second["logs"], "Cursor page is empty"
+        assert not first_ids & {log["log_id"] for log in second["logs"]}
+        
+        res = requests.get(f"{BASE_URL}/api/logs", params={"limit": 5, "cursor": "not-a-cursor"}, headers=headers)
+        assert res.status_code == 400
+        
+        print(f"✅ Logs cursor returned {len(second['logs'])} new entries")
+
+
+class TestDirectReferrals:
+    """The sponsor's direct_referrals_count follows admin status changes"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    def network_size(self, admin_token, sponsor_id):
+        """Return (count on the user, network_size in the ranking or None if not ranked)"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        res = requests.get(f"{BASE_URL}/api/users/{sponsor_id}", headers=headers)
+        assert res.status_code == 200
+        count = res.json()["direct_referrals_count"]
+        
+        res = requests.get(f"{BASE_URL}/api/ranking/resellers", params={"metric": "network", "period": "all", "limit": 100}, headers=headers)
+        assert res.status_code == 200
+        ranked = [r["network_size"] for r in res.json()["ranking"] if r["user_id"] == sponsor_id]
+        return count, ranked[0] if ranked else None
+    
+    def test_cancel_and_reactivate_referral(self, admin_token):
+        """Test cancelling a referral through PUT lowers the sponsor's count and reactivating restores it"""
+        sponsor, _ = register_test_user(access_level=4, name="TEST_Patrocinador")
+        referrals = []
+        for _ in range(2):
+            res = requests.post(f"{BASE_URL}/api/auth/register", json={
+                "email": f"TEST_{uuid.uuid4().hex[:10]}@test.com",
+                "password": TEST_PASSWORD,
+                "name": "TEST_Indicado",
+                "access_level": 4,
+                "sponsor_code": sponsor["referral_code"]
+            })
+            assert res.status_code == 200, f"Register failed: {res.text}"
+            referrals.append(res.json()["user"])
+        
+        count, ranked = self.network_size(admin_token, sponsor["user_id"])
+        assert count == 2
+        assert ranked in (None, 2)
+        
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        res = requests.put(f"{BASE_URL}/api/users/{referrals[0]['user_id']}", json={"status": "cancelled"}, headers=headers)
+        assert res.status_code == 200, f"Cancel failed: {res.text}"
+        count, ranked = self.network_size(admin_token, sponsor["user_id"])
+        assert count == 1
+        assert ranked in (None, 1)
+        
+        res = requests.put(f"{BASE_URL}/api/users/{referrals[0]['user_id']}", json={"status": "active"}, headers=headers)
+        assert res.status_code == 200, f"Reactivate failed: {res.text}"
+        count, ranked = self.network_size(admin_token, sponsor["user_id"])
+        assert count == 2
+        assert ranked in (None, 2)
+        
+        print("✅ Sponsor's direct referral count follows cancel/reactivate")
+
+
+class TestSponsorChange:
+    """Moving a reseller to a new sponsor rewrites its downline's ancestor paths"""
+    
+    @pytest.fixture
+    def admin_token(self):
+        """Get admin token"""
+        res = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL,
+            "password": ADMIN_PASSWORD
+        })
+        if res.status_code == 200:
+            return res.json().get("token")
+        pytest.skip("Admin login failed")
+    
+    def get_user(self, admin_token, user_id):
+        res = requests.get(f"{BASE_URL}/api/users/{user_id}", headers={"Authorization": f"Bearer {admin_token}"})
+        assert res.status_code == 200
+        return res.json()
+    
+    def order_commission_levels(self, token, order_id):
+        res = requests.get(f"{BASE_URL}/api/commissions", params={"limit": 100}, headers={"Authorization": f"Bearer {token}"})
+        assert res.status_code == 200
+        return [c["level"] for c in res.json()["commissions"] if c["order_id"] == order_id]
+    
+    def test_move_sponsor_updates_downline_and_commissions(self, admin_token):
+        """Test the moved reseller's downline gets the new path and pays the new upline"""
+        old_sponsor, old_sponsor_token = register_test_user(access_level=4, name="TEST_Patrocinador_Antigo")
+        new_sponsor, new_sponsor_token = register_test_user(access_level=4, name="TEST_Patrocinador_Novo")
+        moved, moved_token = register_test_user(access_level=4, name="TEST_Movido", sponsor=old_sponsor)
+        child, child_token = register_test_user(access_level=4, name="TEST_Filho", sponsor=moved)
+        grandchild, _ = register_test_user(access_level=4, name="TEST_Neto", sponsor=child)
+        
+        assert self.get_user(admin_token, grandchild["user_id"])["ancestors"] == [
+            old_sponsor["user_id"], moved["user_id"], child["user_id"]
+        ]
+        
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        res = requests.post(f"{BASE_URL}/api/users/convert", json={
+            "user_id": moved["user_id"],
+            "new_access_level": 4,
+            "sponsor_code": new_sponsor["referral_code"]
+        }, headers=headers)
+        assert res.status_code == 200, f"Convert failed: {res.text}"
+        
+        expected = {
+            moved["user_id"]: [new_sponsor["user_id"]],
+            child["user_id"]: [new_sponsor["user_id"], moved["user_id"]],
+            grandchild["user_id"]: [new_sponsor["user_id"], moved["user_id"], child["user_id"]],
+        }
+        for user_id, ancestors in expected.items():
+            moved_user = self.get_user(admin_token, user_id)
+            assert moved_user["ancestors"] == ancestors
+            assert moved_user["hierarchy_level"] == len(ancestors)
+        assert self.get_user(admin_token, moved["user_id"])["sponsor_id"] == new_sponsor["user_id"]
+        
+        # An order referred by the child pays child, moved reseller and the new sponsor
+        res = requests.post(f"{BASE_URL}/api/products", json={
+            "name": "TEST_Produto Rede",
+            "description": "Produto para teste de troca de patrocinador",
+            "price": 100.0,
+            "category": "Teste",
+            "stock": 10,
+            "active": True
+        }, headers=headers)
+        assert res.status_code == 200, f"Create product failed: {res.text}"
+        product_id = res.json()["product_id"]
+        
+        res = requests.post(f"{BASE_URL}/api/orders", json={
+            "items": [{"product_id": product_id, "quantity": 1}],
+            "shipping_address": {"street": "Rua Teste", "city": "São Paulo", "state": "SP", "zip": "01000-000"},
+            "payment_method": "pix",
+            "referral_code": child["referral_code"]
+        }, headers=headers)
+        assert res.status_code == 200, f"Create order failed: {res.text}"
+        order_id = res.json()["order_id"]
+        
+        res = requests.put(f"{BASE_URL}/api/orders/{order_id}/status", params={"status": "paid"}, headers=headers)
+        assert res.status_code == 200, f"Pay order failed: {res.text}"
+        
+        assert self.order_commission_levels(child_token, order_id) == [1]
+        assert self.order_commission_levels(moved_token, order_id) == [2]
+        assert self.order_commission_levels(new_sponsor_token, order_id) == [3]
+        assert self.order_commission_levels(old_sponsor_token, order_id) == []
+        
+        requests.delete(f"{BASE_URL}/api/products/{product_id}", headers=headers)
+        print("✅ Sponsor change rewrote the downline paths and the commission chain")
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])